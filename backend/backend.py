@@ -1,12 +1,53 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+import json
 import uvicorn
+import model.llm_wrapper.services.http_client as http_client
 import model.llm_wrapper.services.soil_service as soil_service
 import model.llm_wrapper.services.current_weather_service as current_weather_service
-from model.llm_wrapper.domain_logic.risk_stats import get_stats
+from model.llm_wrapper.domain_logic.risk_stats import get_stats_async
+from model.llm_wrapper.domain_logic.batch_risk_stats import get_batch_stats
+from model.llm_wrapper.domain_logic import risk_grid_job
+from model.llm_wrapper.domain_logic import prefetch_scheduler
+from model.llm_wrapper.services.field_registry import get_field_registry
+from model.llm_wrapper.services.nowcast_cache import close_nowcast_cache
+from model.llm_wrapper.services.soil_cache import get_soil_cache
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app):
+    http_client.start()
+    tasks = []
+    if risk_grid_job.build_hour() is not None:
+        tasks.append(
+            asyncio.create_task(risk_grid_job.run_nightly(risk_grid_job.build_hour()))
+        )
+    tasks.append(
+        asyncio.create_task(
+            prefetch_scheduler.run_flush(prefetch_scheduler.flush_interval())
+        )
+    )
+    if prefetch_scheduler.prefetch_hour() is not None:
+        tasks.append(
+            asyncio.create_task(
+                prefetch_scheduler.run_daily(prefetch_scheduler.prefetch_hour())
+            )
+        )
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await http_client.close()
+    close_nowcast_cache()
+    await asyncio.to_thread(get_field_registry().flush)
+
+
+app = FastAPI(lifespan=lifespan)
 origins = [
     "http://localhost.tiangolo.com",
     "https://localhost.tiangolo.com",
@@ -23,24 +64,87 @@ app.add_middleware(
 )
 
 
+def set_age_headers(response, cached):
+    """
+    Marks nowcast values served from the cache with their age, and as stale
+    when refreshing them upstream failed
+    """
+    response.headers["Age"] = str(cached.age_seconds)
+    if cached.stale:
+        response.headers["Warning"] = '110 - "Response is Stale"'
+
+
 @app.get("/getCurrentWeather")
-def current_weather(latitude: float, longitude: float):
-    return current_weather_service.get_current_weather(latitude, longitude)
+def current_weather(latitude: float, longitude: float, response: Response):
+    get_field_registry().touch(latitude, longitude)
+    cached = current_weather_service.get_cached_current_weather(latitude, longitude)
+    set_age_headers(response, cached)
+    return cached.value
 
 
 @app.get("/getSoilData")
 def soil_conditions(latitude: float, longitude: float):
+    get_field_registry().touch(latitude, longitude)
     return soil_service.fetch_soil_data(latitude, longitude)
 
 
 @app.get("/getRiskStats")
-def algorithm_statistics(latitude: float, longitude: float, crop: str):
-    return get_stats(latitude, longitude, crop)
+async def algorithm_statistics(
+    latitude: float,
+    longitude: float,
+    crop: str,
+    budget_ms: float | None = None,
+    x_latency_budget: float | None = Header(None),
+):
+    """
+    The latency budget in milliseconds, from budget_ms or the
+    X-Latency-Budget header, bounds the upstream calls, see risk_stats
+    """
+    get_field_registry().touch(latitude, longitude, crop)
+    budget = budget_ms if budget_ms is not None else x_latency_budget
+    return await get_stats_async(
+        latitude, longitude, crop, None if budget is None else budget / 1000
+    )
+
+
+class RiskStatsRequest(BaseModel):
+    latitude: float
+    longitude: float
+    crop: str
+
+
+@app.post("/getRiskStats/batch")
+def batch_algorithm_statistics(fields: list[RiskStatsRequest]):
+    records = [(field.latitude, field.longitude, field.crop) for field in fields]
+    lines = (json.dumps(stats) + "\n" for stats in get_batch_stats(records))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+
+@app.post("/registerFields")
+def register_fields(fields: list[RiskStatsRequest]):
+    """
+    Registers fields for the background prefetch ahead of the morning peak
+    """
+    registry = get_field_registry()
+    for field in fields:
+        registry.register(field.latitude, field.longitude, field.crop)
+    return {"registered": len(fields)}
 
 
 @app.get("/getCloudiness")
-def cloudiness(latitude: float, longitude: float):
-    return current_weather_service.get_cloudiness(latitude, longitude)
+def cloudiness(latitude: float, longitude: float, response: Response):
+    cached = current_weather_service.get_cached_cloudiness(latitude, longitude)
+    set_age_headers(response, cached)
+    return cached.value
+
+
+@app.get("/getUpstreamStats")
+def upstream_statistics():
+    return {
+        "single_flight": http_client.single_flight_stats(),
+        "hosts": http_client.resilience_stats(),
+        "soil_cache": get_soil_cache().stats(),
+    }
 
 
 def serve():
@@ -1,4 +1,3 @@
-from datetime import datetime, timedelta
 import json
 import os
 import argparse
@@ -6,8 +5,7 @@ from pathlib import Path
 from backend.model.llm_wrapper.domain_logic.recommendations import recommend_products
 from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
-import numpy as np
-from services.current_weather_service import get_current_weather, get_historical_weather_year_ago, get_historical_weather_two_year_ago
+from backend.model.llm_wrapper.domain_logic.weather_prediction import forecast_for, predict_weather
 # from services.soil_service import fetch_soil_data
 # from domain_logic.calculations import calculate_gdd, calculate_yield_risk
 # from domain_logic.recommendations import recommend_fertilizer
@@ -26,7 +24,7 @@ class LLMAgent:
             raise Exception(f"Failed to initialize LLM: {str(e)}")
         
 
-    def recommend_products(self, crop_type, weather_prediction, soil_data=None, latitude=None, longitude=None):
+    def recommend_products(self, crop_type, weather_prediction=None, soil_data=None, latitude=None, longitude=None):
         """Call the recommendation function with the provided parameters"""
         return recommend_products(crop_type, weather_prediction, soil_data, latitude, longitude)
     
@@ -144,80 +142,25 @@ class LLMAgent:
         Returns:
             dict: Predicted weather data including temperature, humidity, etc.
         """
-        # Get current weather
-        current_data = get_current_weather(latitude, longitude)
-        
-        # Get weather from same date last year
-        one_year_ago = get_historical_weather_year_ago(latitude, longitude)
-        
-        # Get weather from same date two years ago
-        two_years_ago = get_historical_weather_two_year_ago(latitude, longitude)
-        
-        # Determine the target date (days_ahead from now)
-        target_date = (datetime.now() + timedelta(days=days_ahead)).strftime("%Y-%m-%d")
-        
-        # Initialize prediction result
-        prediction = {
-            "latitude": latitude,
-            "longitude": longitude,
-            "target_date": target_date,
-            "prediction_created": datetime.now().isoformat(),
-            "forecast": {}
-        }
-        
-        # List of weather parameters to predict
-        params = ["temperature", "humidity", "wind_speed", "wind_direction", "precipitation"]
-        
-        # Check which parameters are available in all three datasets
-        available_params = []
-        for param in params:
-            if (param in current_data and 
-                param in one_year_ago and 
-                param in two_years_ago):
-                available_params.append(param)
-        
-        # Simple weighted average prediction model
-        # Weight current conditions more heavily than historical
-        weights = [0.5, 0.3, 0.2]  # Current, 1yr ago, 2yrs ago
-        
-        for param in available_params:
-            try:
-                # Get values, converting to numeric
-                current_value = float(current_data.get(param, 0))
-                yr1_value = float(one_year_ago.get(param, 0))
-                yr2_value = float(two_years_ago.get(param, 0))
-                
-                # Calculate weighted average
-                predicted_value = (
-                    weights[0] * current_value +
-                    weights[1] * yr1_value +
-                    weights[2] * yr2_value
-                )
-                
-                # Add seasonal trend adjustment (simple linear)
-                seasonal_trend = (yr1_value - yr2_value) / 365 * days_ahead
-                predicted_value += seasonal_trend
-                
-                # Round to 2 decimal places for readability
-                prediction["forecast"][param] = round(predicted_value, 2)
-                
-                # Add confidence level based on variance
-                values = [current_value, yr1_value, yr2_value]
-                variance = np.var(values)
-                # Higher variance = lower confidence
-                max_variance = max(values) * 0.5  # Arbitrary threshold
-                confidence = max(0, min(100, 100 * (1 - variance/max_variance)))
-                prediction["forecast"][f"{param}_confidence"] = round(confidence)
-                
-            except (ValueError, TypeError) as e:
-                # Skip parameters that can't be converted to numeric
-                print(f"Error processing {param}: {e}")
+        prediction = forecast_for(latitude, longitude, days_ahead)
+        target_date = prediction["target_date"]
         
         # Add a narrative summary
         prediction["summary"] = self._generate_weather_narrative(prediction["forecast"], target_date)
         
         return prediction
     
+    def predict_future_weather_horizons(self, latitude, longitude, horizons):
+        """
+        Predicts weather for several days ahead at once, e.g. 1-14 for a
+        two-week chart, with one fetch of the current and historical data.
+        
+        Returns:
+            dict: Table with one forecast row per parameter and one column
+            per horizon, see weather_prediction.predict_weather
+        """
+        return predict_weather(latitude, longitude, horizons)
+    
     def _generate_weather_narrative(self, forecast, target_date):
         """Generate a human-readable narrative of the weather prediction"""
         
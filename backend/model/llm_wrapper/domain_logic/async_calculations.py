@@ -0,0 +1,124 @@
+"""
+Asyncio variant of calculations.py
+
+Every function takes an AsyncEvaluationContext, independent upstream calls
+of a risk calculation are awaited concurrently and duplicate series share
+one fetch.
+"""
+
+import asyncio
+from functools import partial
+
+from model.llm_wrapper.services.meteoblue_dataset import get_query_async
+
+from model.llm_wrapper.domain_logic.evaluation_context import AsyncEvaluationContext
+from model.llm_wrapper.domain_logic.calculations import (
+    DAILY_MAXIMUM_TEMPERATURE,
+    DAILY_MINIMUM_TEMPERATURE,
+    AVERAGE_TEMPERATURE,
+    CUMULATIVE_RAINFALL,
+    CUMULATIVE_EVAPORATION,
+    GROWING_DEGREE_DAYS,
+    calculate_daytime_heat_stress_risk,
+    calculate_nighttime_heat_stress_risk,
+    calculate_frost_stress,
+    calculate_drought_risk,
+    calculate_yield_risk,
+    get_day_window,
+    get_season_window,
+)
+
+
+async def get_daytime_heat_stress_risk(context, crop_type):
+    t_max = await get_daily_maximum_temperature(context)
+    return calculate_daytime_heat_stress_risk(t_max, crop_type)
+
+
+async def get_nighttime_heat_stress_risk(context, crop_type):
+    t_min = await get_daily_minimum_temperature(context)
+    return calculate_nighttime_heat_stress_risk(t_min, crop_type)
+
+
+async def get_frost_stress(context, crop_type):
+    t_min = await get_daily_minimum_temperature(context)
+    return calculate_frost_stress(t_min, crop_type)
+
+
+async def get_drought_risk(context):
+    start, end = get_season_window(context)
+
+    (
+        cumulative_rainfall,
+        cumulative_evaporation,
+        soil_moisture,
+        average_temperature,
+    ) = await asyncio.gather(
+        get_cumulative_rainfall(context, start, end),
+        get_cumulative_evaporation(context, start, end),
+        get_soil_moisture(context),
+        get_average_temperature(context, start, end),
+    )
+    return calculate_drought_risk(
+        cumulative_rainfall, cumulative_evaporation, soil_moisture, average_temperature
+    )
+
+
+async def get_yield_risk(context, crop_type, start=None, end=None):
+    if start is None or end is None:
+        start, end = get_season_window(context)
+
+    growing_degree_days, cumulative_rainfall, soil_data = await asyncio.gather(
+        get_growing_degree_days(context, start, end),
+        get_cumulative_rainfall(context, start, end),
+        context.soil(),
+    )
+    return calculate_yield_risk(
+        growing_degree_days,
+        cumulative_rainfall,
+        soil_data["soil_ph"],
+        soil_data["soil_nitrogen_content"],
+        crop_type,
+    )
+
+
+async def get_soil_moisture(context):
+    """
+    Returns soil moisture in percentage
+    """
+    return (await context.soil())["soil_moisture"]
+
+
+async def get_growing_degree_days(context, start, end):
+    return await context.sum(GROWING_DEGREE_DAYS, start, end)
+
+
+async def get_average_temperature(context, start, end):
+    return await context.mean(AVERAGE_TEMPERATURE, start, end)
+
+
+async def get_cumulative_rainfall(context, start, end):
+    """
+    Returns cumulative rainfall over a time period in mm
+    """
+    return await context.sum(CUMULATIVE_RAINFALL, start, end)
+
+
+async def get_cumulative_evaporation(context, start, end):
+    """
+    Returns cumulative evaporation over a time period in mm
+    """
+    return await context.sum(CUMULATIVE_EVAPORATION, start, end)
+
+
+async def get_daily_maximum_temperature(context):
+    start, end = get_day_window(context)
+    return float((await context.series(DAILY_MAXIMUM_TEMPERATURE, start, end))[0])
+
+
+async def get_daily_minimum_temperature(context):
+    start, end = get_day_window(context)
+    return float((await context.series(DAILY_MINIMUM_TEMPERATURE, start, end))[0])
+
+
+def create_context(client, latitude, longitude):
+    return AsyncEvaluationContext(latitude, longitude, partial(get_query_async, client))
@@ -0,0 +1,204 @@
+"""
+Risk statistics for many fields at once
+
+Records are packed into Meteoblue MultiPoint requests of at most
+BATCH_MAX_POINTS distinct points (fields in the same grid cell share one
+point). The inputs of all fields of a request are reduced from the
+(points, days) arrays of the response and scored together with
+vectorized_calculations; results are yielded as soon as their request is
+done. Every result carries the code of the state of its field, looked up
+for the whole request at once, so clients can aggregate per state.
+
+Results have the shape of /getRiskStats: risks without a score, because an
+input is missing or the request failed, are served from the last value of
+the field cell and listed under "stale", or listed under "unavailable".
+"""
+
+import os
+from datetime import datetime
+
+import numpy as np
+
+import model.llm_wrapper.domain_logic.vectorized_calculations as vectorized
+from model.llm_wrapper.domain_logic.calculations import (
+    AVERAGE_TEMPERATURE,
+    CUMULATIVE_EVAPORATION,
+    CUMULATIVE_RAINFALL,
+    DAILY_MAXIMUM_TEMPERATURE,
+    DAILY_MINIMUM_TEMPERATURE,
+    GROWING_DEGREE_DAYS,
+    create_context,
+    get_day_window,
+    get_season_window,
+)
+from model.llm_wrapper.domain_logic.crop_parameters import CROPS
+from model.llm_wrapper.domain_logic.risk_stats import RISKS, build_available_stats
+from model.llm_wrapper.services.grid import shared_point
+from model.llm_wrapper.services.meteoblue_dataset import get_query
+from model.llm_wrapper.services.query_planner import QueryPlanner
+from model.llm_wrapper.services.soil_cache import SOIL_DOMAIN, get_soil_cache
+from model.llm_wrapper.services.soil_service import plan_soil_data, parse_soil_data
+from model.llm_wrapper.services.state_index import get_state_index
+
+DAY_SERIES = (DAILY_MAXIMUM_TEMPERATURE, DAILY_MINIMUM_TEMPERATURE)
+SEASON_SERIES = (
+    CUMULATIVE_RAINFALL,
+    CUMULATIVE_EVAPORATION,
+    AVERAGE_TEMPERATURE,
+    GROWING_DEGREE_DAYS,
+)
+# Every domain a request queries, fields sharing the point sent for all of
+# them share the inputs
+POINT_DOMAINS = tuple(
+    {series["domain"] for series in DAY_SERIES + SEASON_SERIES} | {SOIL_DOMAIN}
+)
+
+UPSTREAM_FAILED = "upstream request failed"
+UNKNOWN_CROP = "unknown crop"
+
+
+def max_points_per_request():
+    return int(os.getenv("BATCH_MAX_POINTS", 100))
+
+
+def get_batch_stats(records):
+    """
+    Input: iterable of (latitude, longitude, crop_type)
+    Yields dictionary {"latitude", "longitude", "crop", "state", **stats} per
+    record, with "error" instead of the stats for unknown crops. "state" is
+    None outside the states
+    """
+    for chunk, scores, _ in get_batch_scores(records):
+        states = get_state_codes(chunk)
+        for (latitude, longitude, crop_type), state, row in zip(chunk, states, scores):
+            result = {
+                "latitude": latitude,
+                "longitude": longitude,
+                "crop": crop_type,
+                "state": state,
+            }
+            if crop_type not in CROPS:
+                result["error"] = UNKNOWN_CROP
+            else:
+                result.update(
+                    build_available_stats(
+                        latitude,
+                        longitude,
+                        crop_type,
+                        [
+                            None if np.isnan(score) else round(float(score), 2)
+                            for score in row
+                        ],
+                    )
+                )
+            yield result
+
+
+def get_state_codes(records):
+    """
+    Returns the state code of every (latitude, longitude, crop_type), all None
+    when the state boundaries cannot be loaded
+    """
+    try:
+        state_index = get_state_index()
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error loading state index: {e}")
+        return [None] * len(records)
+    return state_index.state_codes(
+        [latitude for latitude, _, _ in records],
+        [longitude for _, longitude, _ in records],
+    ).tolist()
+
+
+def get_batch_scores(records):
+    """
+    Input: iterable of (latitude, longitude, crop_type)
+    Yields (records, scores, error) per request, scores is a float64 array
+    of (records, RISKS), NaN where an input is missing or the crop unknown,
+    error is set when the whole request failed
+    """
+    chunk = []
+    points = set()
+    for record in records:
+        point = shared_point(record[0], record[1], POINT_DOMAINS)
+        if point not in points and len(points) == max_points_per_request():
+            yield _get_chunk_scores(chunk)
+            chunk, points = [], set()
+        chunk.append(record)
+        points.add(point)
+    if chunk:
+        yield _get_chunk_scores(chunk)
+
+
+def _get_chunk_scores(records):
+    record_points = [
+        shared_point(latitude, longitude, POINT_DOMAINS)
+        for latitude, longitude, _ in records
+    ]
+    points = list(dict.fromkeys(record_points))
+    point_indices = {point: index for index, point in enumerate(points)}
+    rows = np.array([point_indices[point] for point in record_points])
+
+    # A shared reference time gives every record the same windows
+    context = create_context(*points[0], now=datetime.now())
+    day_start, day_end = get_day_window(context)
+    season_start, season_end = get_season_window(context)
+    planner = QueryPlanner.for_points(points)
+    day_keys = [
+        planner.add(**series, start=day_start, end=day_end) for series in DAY_SERIES
+    ]
+    season_keys = [
+        planner.add(**series, start=season_start, end=season_end)
+        for series in SEASON_SERIES
+    ]
+
+    soil_cache = get_soil_cache()
+    soil = {point: soil_cache.get(*point) for point in points}
+    soil_keys = None
+    if any(soil_data is None for soil_data in soil.values()):
+        soil_keys = plan_soil_data(planner, context.now)
+
+    try:
+        response = get_query(planner.build())
+    except Exception as e:
+        print(f"Error fetching batch of {len(points)} points: {e}")
+        return records, np.full((len(records), len(RISKS)), np.nan), UPSTREAM_FAILED
+
+    for index, point in enumerate(points):
+        if soil[point] is None:
+            soil[point] = parse_soil_data(planner.slice(response, index), soil_keys)
+            soil_cache.put(*point, soil[point])
+
+    t_max, t_min = (response[key].values[:, 0] for key in day_keys)
+    rainfall, evaporation, temperatures, growing_degree_days = (
+        response[key].values for key in season_keys
+    )
+    # NaN for points without any temperature, like the scalar mean
+    with np.errstate(divide="ignore", invalid="ignore"):
+        average_temperature = np.nansum(temperatures, axis=1) / np.sum(
+            ~np.isnan(temperatures), axis=1
+        )
+    soil_columns = {
+        name: np.array(
+            [
+                np.nan if soil[point][name] is None else soil[point][name]
+                for point in points
+            ]
+        )
+        for name in ("soil_moisture", "soil_ph", "soil_nitrogen_content")
+    }
+
+    risks = vectorized.calculate_risks(
+        t_max[rows],
+        t_min[rows],
+        np.nansum(rainfall, axis=1)[rows],
+        np.nansum(evaporation, axis=1)[rows],
+        soil_columns["soil_moisture"][rows],
+        average_temperature[rows],
+        np.nansum(growing_degree_days, axis=1)[rows],
+        soil_columns["soil_ph"][rows],
+        soil_columns["soil_nitrogen_content"][rows],
+        [crop_type for _, _, crop_type in records],
+    )
+    scores = np.column_stack([risks[risk][0] for risk in RISKS])
+    return records, scores, None
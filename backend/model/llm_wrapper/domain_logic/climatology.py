@@ -0,0 +1,193 @@
+"""
+Day-of-year climate normals on a regular grid over the Brazilian states
+
+Built offline by climatology_job from multi-year daily history and stored
+in a directory of three files, opened memory-mapped so a lookup only pages
+in the days it reads:
+
+    index.npy    int32 (rows, columns), slot of the cell or -1
+    normals.npy  float16 (slots, 366, variables, 2), mean and variance
+    meta.json    origin, step, variables, years and build time
+
+Cell (i, j) is centered on the grid point ((origin_row + i) * step,
+(origin_column + j) * step), like the risk grid. Days are indexed as
+days of a leap year, so February 29 has its own slot and March 1 has the
+same index every year. Only covered cells have a slot, about 80 MB for
+the states at the native 0.25 degree grid.
+
+The normals are built from the NEMSGLOBAL daily aggregates of
+CLIMATOLOGY_CODES. Wind direction has no normal: the daily aggregate of the
+dataset is an arithmetic mean, which is meaningless for angles.
+"""
+
+import json
+import math
+import os
+import threading
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+
+VARIABLES = ("temperature", "humidity", "wind_speed", "precipitation")
+CLIMATOLOGY_DOMAIN = "NEMSGLOBAL"
+CLIMATOLOGY_CODES = {
+    "temperature": {"code": 11, "level": "2 m above gnd", "aggregation": "mean"},
+    "humidity": {"code": 52, "level": "2 m above gnd", "aggregation": "mean"},
+    "wind_speed": {"code": 32, "level": "10 m above gnd", "aggregation": "mean"},
+    "precipitation": {"code": 61, "level": "sfc", "aggregation": "sum"},
+}
+STATISTICS = ("mean", "variance")
+DAYS = 366
+DEFAULT_PATH = Path(__file__).parent.parent / "data" / "climatology"
+
+_store = None
+_store_mtime = None
+_store_lock = threading.Lock()
+
+
+def climatology_path():
+    return Path(os.getenv("CLIMATOLOGY_PATH", str(DEFAULT_PATH)))
+
+
+def daily_series(variable):
+    """
+    Returns the series of the daily values the normals of variable are
+    built from
+    """
+    return {
+        "domain": CLIMATOLOGY_DOMAIN,
+        "gap_fill_domain": None,
+        "time_resolution": "daily",
+        "code_dict": CLIMATOLOGY_CODES[variable],
+    }
+
+
+def day_index(day):
+    """
+    Returns the 0..365 index of a date as a day of a leap year
+    """
+    return (date(2000, day.month, day.day) - date(2000, 1, 1)).days
+
+
+def day_indices(days):
+    """
+    Vectorized day_index of a datetime64 array
+    """
+    days = np.asarray(days, dtype="datetime64[D]")
+    years = days.astype("datetime64[Y]")
+    ordinal = (days - years).astype(np.int64)
+    year = years.astype(np.int64) + 1970
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    return ordinal + ((~leap) & (ordinal >= 59))
+
+
+class Climatology:
+    def __init__(
+        self,
+        index,
+        normals,
+        origin_row,
+        origin_column,
+        step,
+        variables,
+        years,
+        built_at,
+    ):
+        self.index = index
+        self.normals = normals
+        self.origin_row = origin_row
+        self.origin_column = origin_column
+        self.step = step
+        self.variables = tuple(variables)
+        self.years = tuple(years)
+        self.built_at = built_at
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text())
+        return cls(
+            np.load(path / "index.npy", mmap_mode="r"),
+            np.load(path / "normals.npy", mmap_mode="r"),
+            meta["origin"][0],
+            meta["origin"][1],
+            meta["step"],
+            meta["variables"],
+            meta["years"],
+            datetime.fromisoformat(meta["built_at"]),
+        )
+
+    def save(self, path):
+        """
+        Writes the arrays first and meta.json last, readers reload on the
+        change of meta.json
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name, array in (("index", self.index), ("normals", self.normals)):
+            temporary = path / f"{name}.tmp.npy"
+            np.save(temporary, array)
+            os.replace(temporary, path / f"{name}.npy")
+        temporary = path / "meta.tmp.json"
+        temporary.write_text(
+            json.dumps(
+                {
+                    "origin": [self.origin_row, self.origin_column],
+                    "step": self.step,
+                    "variables": list(self.variables),
+                    "years": list(self.years),
+                    "built_at": self.built_at.isoformat(),
+                }
+            )
+        )
+        os.replace(temporary, path / "meta.json")
+
+    def slot(self, latitude, longitude):
+        """
+        Returns the slot of the cell of the grid point nearest to the point
+        or None
+        """
+        row = math.floor(latitude / self.step + 0.5) - self.origin_row
+        column = math.floor(longitude / self.step + 0.5) - self.origin_column
+        rows, columns = self.index.shape
+        if not (0 <= row < rows and 0 <= column < columns):
+            return None
+        slot = int(self.index[row, column])
+        return None if slot < 0 else slot
+
+    def lookup(self, latitude, longitude, days):
+        """
+        Returns float32 array (days, variables, 2) of mean and variance for
+        a list of dates, or None when the point is not covered
+        """
+        slot = self.slot(latitude, longitude)
+        if slot is None:
+            return None
+        normals = self.normals[slot, [day_index(day) for day in days]]
+        if np.isnan(normals).any():
+            return None
+        return normals.astype(np.float32)
+
+
+def get_climatology():
+    """
+    Returns the stored Climatology, reloaded when it is rebuilt, or None
+    when there is none
+    """
+    global _store, _store_mtime
+    path = climatology_path()
+    try:
+        mtime = (path / "meta.json").stat().st_mtime
+    except OSError:
+        return None
+    if mtime != _store_mtime:
+        with _store_lock:
+            if mtime != _store_mtime:
+                try:
+                    _store = Climatology.load(path)
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Error loading climatology {path}: {e}")
+                    _store = None
+                _store_mtime = mtime
+    return _store
@@ -0,0 +1,173 @@
+"""
+Offline build of the climate normals (see climatology)
+
+Covers the same cells as the risk grid. For every batch of cells one
+MultiPoint request asks for the daily temperature, humidity, wind speed and
+precipitation of the last CLIMATOLOGY_YEARS complete years, one time
+interval per year. The values of each day of the year are pooled over the
+years and over a window of CLIMATOLOGY_WINDOW_DAYS days on both sides, which
+smooths the normals and gives February 29 enough samples. The normals
+change with the years only, run it from a scheduler once a year with
+
+    python -m model.llm_wrapper.domain_logic.climatology_job
+"""
+
+import os
+from datetime import date, datetime
+
+import numpy as np
+
+from model.llm_wrapper.services.meteoblue_dataset import get_query
+from model.llm_wrapper.domain_logic.climatology import (
+    CLIMATOLOGY_CODES,
+    CLIMATOLOGY_DOMAIN,
+    DAYS,
+    STATISTICS,
+    VARIABLES,
+    Climatology,
+    climatology_path,
+    day_indices,
+)
+from model.llm_wrapper.domain_logic.risk_grid_job import covered_region
+from model.llm_wrapper.services.grid import resolution
+from model.llm_wrapper.services.meteoblue_model import (
+    MeteoblueQuery,
+    format_time_interval,
+)
+from model.llm_wrapper.services.state_index import get_state_index
+
+
+def climatology_step():
+    return float(os.getenv("CLIMATOLOGY_STEP", resolution(CLIMATOLOGY_DOMAIN)))
+
+
+def climatology_years(today=None):
+    years = int(os.getenv("CLIMATOLOGY_YEARS", 10))
+    last = (today or date.today()).year - 1
+    return list(range(last - years + 1, last + 1))
+
+
+def window_days():
+    return int(os.getenv("CLIMATOLOGY_WINDOW_DAYS", 7))
+
+
+def max_points_per_request():
+    return int(os.getenv("CLIMATOLOGY_BATCH_POINTS", 100))
+
+
+def fetch_daily_history(points, years):
+    """
+    Returns (sums, squares, counts) of the points, arrays of shape
+    (points, DAYS, variables) over the daily values of years
+    """
+    intervals = [
+        format_time_interval(date(year, 1, 1), date(year, 12, 31)) for year in years
+    ]
+    query = (
+        MeteoblueQuery()
+        .with_points(points)
+        .with_time_intervals(intervals)
+        .with_codes(CLIMATOLOGY_DOMAIN, None, "daily", CLIMATOLOGY_CODES.values())
+    )
+    decoded = get_query(query)
+
+    shape = (len(points), DAYS, len(VARIABLES))
+    sums, squares, counts = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    for variable_index, variable in enumerate(VARIABLES):
+        for interval in intervals:
+            series = decoded.series(
+                CLIMATOLOGY_DOMAIN,
+                None,
+                "daily",
+                CLIMATOLOGY_CODES[variable],
+                interval,
+            )
+            # Days are unique within a year, so fancy indexing accumulates
+            days = day_indices(series.timestamps)
+            values = series.values.astype(np.float64)
+            present = np.isfinite(values)
+            values = np.where(present, values, 0)
+            sums[:, days, variable_index] += values
+            squares[:, days, variable_index] += values**2
+            counts[:, days, variable_index] += present
+    return sums, squares, counts
+
+
+def pool_window(array, days):
+    """
+    Sums array over days on both sides of every day of the year, circularly
+    """
+    return sum(np.roll(array, shift, axis=1) for shift in range(-days, days + 1))
+
+
+def normals_of(sums, squares, counts, days):
+    """
+    Returns float16 array (points, DAYS, variables, 2) of mean and variance,
+    NaN where there is no value
+    """
+    sums, squares, counts = (
+        pool_window(sums, days),
+        pool_window(squares, days),
+        pool_window(counts, days),
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = sums / counts
+        variance = np.maximum(squares / counts - mean**2, 0)
+    return np.stack([mean, variance], axis=-1).astype(np.float16)
+
+
+def build_climatology(step=None, state_index=None, today=None):
+    step = step or climatology_step()
+    years = climatology_years(today)
+    origin_row, origin_column, latitudes, longitudes, covered = covered_region(
+        step, state_index or get_state_index()
+    )
+
+    cells = np.argwhere(covered)
+    index = np.full(covered.shape, -1, dtype=np.int32)
+    index[cells[:, 0], cells[:, 1]] = np.arange(len(cells))
+    normals = np.full(
+        (len(cells), DAYS, len(VARIABLES), len(STATISTICS)), np.nan, dtype=np.float16
+    )
+
+    failed = 0
+    batch = max_points_per_request()
+    for start in range(0, len(cells), batch):
+        points = [
+            (float(latitudes[row]), float(longitudes[column]))
+            for row, column in cells[start : start + batch]
+        ]
+        try:
+            history = fetch_daily_history(points, years)
+        except Exception as e:
+            print(f"Error fetching history of {len(points)} cells: {e}")
+            failed += len(points)
+            continue
+        normals[start : start + len(points)] = normals_of(*history, window_days())
+    if failed:
+        print(f"Climatology: {failed} of {len(cells)} cells have no normals")
+
+    return Climatology(
+        index,
+        normals,
+        origin_row,
+        origin_column,
+        step,
+        VARIABLES,
+        years,
+        datetime.now(),
+    )
+
+
+def build_and_save():
+    climatology = build_climatology()
+    climatology.save(climatology_path())
+    covered = int(np.isfinite(climatology.normals).all(axis=(1, 2, 3)).sum())
+    print(
+        f"Climatology: saved normals of {covered} cells over "
+        f"{climatology.years[0]}-{climatology.years[-1]} to {climatology_path()}"
+    )
+
+
+if __name__ == "__main__":
+    build_and_save()
@@ -0,0 +1,72 @@
+"""
+Crop thresholds of the risk calculations
+
+One row per crop, one column per parameter. Scalar calculations look up a
+crop's values by name, vectorized ones gather whole columns by crop index.
+Unknown crops map to a trailing row of NaN, so their scores come out NaN.
+"""
+
+import numpy as np
+
+PARAMETERS = (
+    "t_max_optimum",
+    "t_max_limit",
+    "t_min_optimum",
+    "t_min_limit",
+    "t_min_no_frost",
+    "t_min_frost",
+    "optimal_growing_degree_days",
+    "optimal_rainfall",
+    "optimal_soil_ph",
+    "optimal_soil_nitrogen",
+)
+
+CROP_PARAMETERS = {
+    "soybean": (32, 45, 22, 28, 4, -3, 2700, 575, 6.4, 0.013),
+    "corn": (33, 44, 22, 28, 4, -3, 2900, 650, 6.4, 0.115),
+    "cotton": (32, 38, 20, 25, 4, -3, 2400, 1000, 6.3, 0.072),
+}
+
+CROPS = tuple(CROP_PARAMETERS)
+UNKNOWN_CROP = len(CROPS)
+
+_parameter_index = {name: index for index, name in enumerate(PARAMETERS)}
+_table = np.vstack(
+    [
+        np.array(list(CROP_PARAMETERS.values()), dtype=np.float64),
+        np.full(len(PARAMETERS), np.nan),
+    ]
+)
+
+
+def get_crop_parameters(crop_type, *names):
+    """
+    Returns tuple of the named parameters of a crop, None for unknown crops
+    """
+    row = CROP_PARAMETERS.get(crop_type)
+    if row is None:
+        return None
+    return tuple(row[_parameter_index[name]] for name in names)
+
+
+def get_crop_indices(crop_types):
+    """
+    Returns int array of table rows for an array of crop names or indices
+    """
+    crop_types = np.asarray(crop_types)
+    if np.issubdtype(crop_types.dtype, np.integer):
+        return np.where(
+            (crop_types >= 0) & (crop_types < UNKNOWN_CROP), crop_types, UNKNOWN_CROP
+        )
+    # One vectorized comparison per crop, the registry only has a few rows
+    rows = np.full(crop_types.shape, UNKNOWN_CROP)
+    for index, crop in enumerate(CROPS):
+        rows[crop_types == crop] = index
+    return rows
+
+
+def get_crop_columns(crop_indices, *names):
+    """
+    Returns one float64 array per named parameter, aligned with crop_indices
+    """
+    return tuple(_table[crop_indices, _parameter_index[name]] for name in names)
@@ -0,0 +1,362 @@
+"""
+Request-scoped memoization of upstream series
+
+One context is created per risk evaluation and handed to the calculation
+functions. Every series is fetched at most once per context, keyed by the
+grid cell of its domain and its query; soil data goes through the soil
+cache once per context. Daily series go through the local series archive,
+so only days missing from it are requested upstream and window sums and
+means are answered from its prefix sums.
+"""
+
+import asyncio
+import math
+from datetime import datetime
+
+import numpy as np
+
+from model.llm_wrapper.services.grid import DOMAIN_RESOLUTIONS, grid_cell
+from model.llm_wrapper.services.meteoblue_model import format_time_interval
+from model.llm_wrapper.services.query_planner import QueryPlanner, series_key
+from model.llm_wrapper.services.series_archive import get_series_archive, is_archived
+from model.llm_wrapper.services.soil_cache import get_soil_cache
+from model.llm_wrapper.services.soil_service import plan_soil_data, parse_soil_data
+
+
+def context_key(latitude, longitude, series, start, end):
+    domain = series["domain"]
+    location = (
+        grid_cell(latitude, longitude, domain)
+        if domain in DOMAIN_RESOLUTIONS
+        else (latitude, longitude)
+    )
+    return (
+        location,
+        series_key(
+            domain,
+            series["gap_fill_domain"],
+            series["time_resolution"],
+            series["code_dict"],
+            format_time_interval(start, end),
+        ),
+    )
+
+
+# Memo marker for series whose window is complete in the series archive
+ARCHIVED = object()
+# Key of the soil data in the results of AsyncEvaluationContext tasks
+SOIL = "soil"
+
+
+def plan_fetch(latitude, longitude, series, start, end):
+    """
+    Returns the (start, end) to request upstream, None when archived
+    """
+    if not is_archived(series, start):
+        return start, end
+    return get_series_archive().plan(latitude, longitude, series, start, end)
+
+
+def store_fetched(latitude, longitude, series, start, fetch_start, data):
+    """
+    Archives freshly fetched data, returns the memo entry of the window
+    """
+    if not is_archived(series, start):
+        return data
+    get_series_archive().store(latitude, longitude, series, fetch_start, data)
+    return ARCHIVED
+
+
+def resolve(latitude, longitude, series, start, end, memoized):
+    if memoized is ARCHIVED:
+        return get_series_archive().read(latitude, longitude, series, start, end)
+    return memoized
+
+
+def aggregate(latitude, longitude, series, start, end, memoized, how):
+    """
+    Returns the sum or mean of a window, ignoring missing values
+    """
+    if memoized is ARCHIVED:
+        archive = get_series_archive()
+        if how == "sum":
+            return archive.window_sum(latitude, longitude, series, start, end)
+        return archive.window_mean(latitude, longitude, series, start, end)
+    present = memoized[~np.isnan(memoized)]
+    if how == "sum":
+        return float(present.sum())
+    return float(present.mean()) if len(present) else math.nan
+
+
+async def off_loop(memoized, function, *args):
+    """
+    Calls function in a worker thread when it reads the archive, directly
+    for memoized data
+    """
+    if memoized is ARCHIVED:
+        return await asyncio.to_thread(function, *args)
+    return function(*args)
+
+
+class EvaluationContext:
+    def __init__(self, latitude, longitude, get_query, now=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.get_query = get_query
+        self.now = now or datetime.now()
+        self.memo = {}
+        self.soil_data = None
+        self.upstream_requests = 0
+
+    def series(self, series, start, end):
+        """
+        Returns the data of series over start..end, fetching it on first use
+        """
+        return resolve(
+            self.latitude,
+            self.longitude,
+            series,
+            start,
+            end,
+            self._memoized(series, start, end),
+        )
+
+    def sum(self, series, start, end):
+        return aggregate(
+            self.latitude,
+            self.longitude,
+            series,
+            start,
+            end,
+            self._memoized(series, start, end),
+            "sum",
+        )
+
+    def mean(self, series, start, end):
+        return aggregate(
+            self.latitude,
+            self.longitude,
+            series,
+            start,
+            end,
+            self._memoized(series, start, end),
+            "mean",
+        )
+
+    def _memoized(self, series, start, end):
+        key = context_key(self.latitude, self.longitude, series, start, end)
+        if key not in self.memo:
+            self.prefetch([(series, start, end)], soil=False)
+        return self.memo[key]
+
+    def store(self, series, start, end, data):
+        """
+        Memoizes data fetched elsewhere, e.g. by a MultiPoint batch request
+        """
+        self.memo[context_key(self.latitude, self.longitude, series, start, end)] = data
+
+    def soil(self):
+        if self.soil_data is None:
+            self.prefetch([], soil=True)
+        return self.soil_data
+
+    def prefetch(self, requirements, soil=True):
+        """
+        Fetches every [(series, start, end)] not memoized yet, plus the soil
+        data when it is not cached, with one planned dataset request
+        """
+        planner = QueryPlanner(self.latitude, self.longitude)
+        planned = {}
+        for series, start, end in requirements:
+            key = context_key(self.latitude, self.longitude, series, start, end)
+            if key in self.memo:
+                continue
+            fetch_window = plan_fetch(self.latitude, self.longitude, series, start, end)
+            if fetch_window is None:
+                self.memo[key] = ARCHIVED
+                continue
+            planned[key] = (
+                planner.add(**series, start=fetch_window[0], end=fetch_window[1]),
+                series,
+                start,
+                fetch_window[0],
+            )
+
+        soil_keys = None
+        if soil and self.soil_data is None:
+            soil_cache = get_soil_cache()
+            self.soil_data = soil_cache.get(self.latitude, self.longitude)
+            if self.soil_data is None:
+                soil_keys = plan_soil_data(planner, self.now)
+
+        if not planner.series:
+            return
+        self.upstream_requests += 1
+        sliced = planner.execute(self.get_query)
+        for key, (planner_key, series, start, fetch_start) in planned.items():
+            self.memo[key] = store_fetched(
+                self.latitude,
+                self.longitude,
+                series,
+                start,
+                fetch_start,
+                sliced[planner_key],
+            )
+        if soil_keys is not None:
+            self.soil_data = parse_soil_data(sliced, soil_keys)
+            soil_cache.put(self.latitude, self.longitude, self.soil_data)
+
+
+class AsyncEvaluationContext:
+    """
+    Asyncio counterpart of EvaluationContext, concurrent calls for the same
+    series await one shared task. A task returns {key: memo entry} of every
+    series it fetched, under SOIL for the soil data, so one prefetch task
+    serves all the series it planned.
+    """
+
+    def __init__(self, latitude, longitude, get_query, now=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.get_query = get_query
+        self.now = now or datetime.now()
+        self.tasks = {}
+        self.soil_task = None
+        self.upstream_requests = 0
+
+    async def series(self, series, start, end):
+        memoized = await self._memoized(series, start, end)
+        return await off_loop(
+            memoized,
+            resolve,
+            self.latitude,
+            self.longitude,
+            series,
+            start,
+            end,
+            memoized,
+        )
+
+    async def sum(self, series, start, end):
+        memoized = await self._memoized(series, start, end)
+        return await off_loop(
+            memoized,
+            aggregate,
+            self.latitude,
+            self.longitude,
+            series,
+            start,
+            end,
+            memoized,
+            "sum",
+        )
+
+    async def mean(self, series, start, end):
+        memoized = await self._memoized(series, start, end)
+        return await off_loop(
+            memoized,
+            aggregate,
+            self.latitude,
+            self.longitude,
+            series,
+            start,
+            end,
+            memoized,
+            "mean",
+        )
+
+    async def _memoized(self, series, start, end):
+        key = context_key(self.latitude, self.longitude, series, start, end)
+        if key not in self.tasks:
+            self.tasks[key] = asyncio.ensure_future(
+                self._fetch([(key, series, start, end)], soil=False)
+            )
+        return (await self.tasks[key])[key]
+
+    async def soil(self):
+        if self.soil_task is None:
+            self.soil_task = asyncio.ensure_future(self._fetch([], soil=True))
+        return (await self.soil_task)[SOIL]
+
+    async def prefetch(self, requirements, soil=True):
+        """
+        Fetches every [(series, start, end)] without a task yet, plus the
+        soil data when it has none, with one planned dataset request. On
+        failure the series and soil are left to be fetched on their own
+        """
+        planned = {}
+        for series, start, end in requirements:
+            key = context_key(self.latitude, self.longitude, series, start, end)
+            if key not in self.tasks:
+                planned[key] = (key, series, start, end)
+        soil = soil and self.soil_task is None
+        if not planned and not soil:
+            return
+
+        task = asyncio.ensure_future(self._fetch(planned.values(), soil))
+        for key in planned:
+            self.tasks[key] = task
+        if soil:
+            self.soil_task = task
+        try:
+            await task
+        except BaseException:
+            for key in planned:
+                if self.tasks.get(key) is task:
+                    del self.tasks[key]
+            if self.soil_task is task:
+                self.soil_task = None
+            raise
+
+    async def _fetch(self, requirements, soil):
+        """
+        Returns {key: memo entry} of [(key, series, start, end)], with the
+        soil data under SOIL when soil is set. The archive and soil cache
+        are read and written in a worker thread, off the event loop
+        """
+        planner = QueryPlanner(self.latitude, self.longitude)
+        fetched, planned, soil_keys = await asyncio.to_thread(
+            self._plan, planner, requirements, soil
+        )
+        if not planner.series:
+            return fetched
+        self.upstream_requests += 1
+        sliced = planner.slice(await self.get_query(planner.build()))
+        await asyncio.to_thread(self._store, sliced, planned, soil_keys, fetched)
+        return fetched
+
+    def _plan(self, planner, requirements, soil):
+        fetched = {}
+        planned = {}
+        for key, series, start, end in requirements:
+            fetch_window = plan_fetch(self.latitude, self.longitude, series, start, end)
+            if fetch_window is None:
+                fetched[key] = ARCHIVED
+                continue
+            planned[key] = (
+                planner.add(**series, start=fetch_window[0], end=fetch_window[1]),
+                series,
+                start,
+                fetch_window[0],
+            )
+
+        soil_keys = None
+        if soil:
+            fetched[SOIL] = get_soil_cache().get(self.latitude, self.longitude)
+            if fetched[SOIL] is None:
+                soil_keys = plan_soil_data(planner, self.now)
+        return fetched, planned, soil_keys
+
+    def _store(self, sliced, planned, soil_keys, fetched):
+        for key, (planner_key, series, start, fetch_start) in planned.items():
+            fetched[key] = store_fetched(
+                self.latitude,
+                self.longitude,
+                series,
+                start,
+                fetch_start,
+                sliced[planner_key],
+            )
+        if soil_keys is not None:
+            fetched[SOIL] = parse_soil_data(sliced, soil_keys)
+            get_soil_cache().put(self.latitude, self.longitude, fetched[SOIL])
@@ -0,0 +1,101 @@
+"""
+Background prefetch of the upstream data of registered fields
+
+Every day at PREFETCH_HOUR, ahead of the morning peak, the scheduler walks
+the field registry, most recently accessed fields first, and loads what
+/getRiskStats, /getCurrentWeather and /getSoilData need into the series
+archive, the soil cache and the nowcast cache. Fields sharing a cell are
+fetched once. At most PREFETCH_RATE fields per second are prefetched, one
+at a time in a worker thread, so the upstream quota is spread over the run.
+In between, the accesses buffered by the registry are written every
+FIELD_REGISTRY_FLUSH_SECONDS.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+from model.llm_wrapper.domain_logic.calculations import create_context, get_risk_series
+from model.llm_wrapper.services.current_weather_service import (
+    get_cached_cloudiness,
+    get_cached_current_weather,
+)
+from model.llm_wrapper.services.field_registry import field_cell, get_field_registry
+
+
+def prefetch_hour():
+    hour = os.getenv("PREFETCH_HOUR")
+    return None if hour is None else int(hour)
+
+
+def prefetch_rate():
+    """
+    Fields per second
+    """
+    return float(os.getenv("PREFETCH_RATE", 1))
+
+
+def flush_interval():
+    """
+    Seconds between writes of the field accesses
+    """
+    return float(os.getenv("FIELD_REGISTRY_FLUSH_SECONDS", 30))
+
+
+def prefetch_field(latitude, longitude):
+    # The risk series and the soil data in one planned request
+    context = create_context(latitude, longitude)
+    context.prefetch(get_risk_series(context))
+    get_cached_current_weather(latitude, longitude)
+    get_cached_cloudiness(latitude, longitude)
+
+
+async def run_prefetch(rate=None):
+    """
+    Prefetches every registered field once, returns the number of fields
+    """
+    interval = 1 / (rate or prefetch_rate())
+    cells = set()
+    prefetched = 0
+    fields = await asyncio.to_thread(get_field_registry().by_priority)
+    for latitude, longitude, _ in fields:
+        cell = field_cell(latitude, longitude)
+        if cell in cells:
+            continue
+        cells.add(cell)
+
+        started = time.monotonic()
+        try:
+            await asyncio.to_thread(prefetch_field, latitude, longitude)
+            prefetched += 1
+        except Exception as e:
+            print(f"Error prefetching field {latitude}, {longitude}: {e}")
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+    return prefetched
+
+
+async def run_daily(hour):
+    """
+    Runs the prefetch every day at hour
+    """
+    while True:
+        now = datetime.now()
+        next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+        prefetched = await run_prefetch()
+        print(f"Prefetch: warmed up {prefetched} fields")
+
+
+async def run_flush(interval):
+    """
+    Writes the field accesses buffered by the registry every interval seconds
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(get_field_registry().flush)
+        except Exception as e:
+            print(f"Error flushing field accesses: {e}")
@@ -1,14 +1,19 @@
 from datetime import datetime, timedelta
-from backend.model.llm_wrapper.domain_logic.calculations import calculate_daytime_heat_stress_risk, calculate_frost_stress, calculate_nighttime_heat_stress_risk, get_drought_risk, get_yield_risk
+from backend.model.llm_wrapper.domain_logic.calculations import create_context, get_daytime_heat_stress_risk, get_frost_stress, get_nighttime_heat_stress_risk, get_drought_risk, get_yield_risk
+from backend.model.llm_wrapper.domain_logic.weather_prediction import forecast_for
 from backend.model.llm_wrapper.services.soil_service import fetch_soil_data
 
-def recommend_products(crop_type, weather_prediction, soil_data=None, latitude=None, longitude=None):
+# Days ahead of the forecast used when no weather prediction is passed
+RECOMMENDATION_HORIZON_DAYS = 7
+
+def recommend_products(crop_type, weather_prediction=None, soil_data=None, latitude=None, longitude=None):
     """
     Recommends products based on crop type, soil data, and weather predictions.
 
     Args:
         crop_type (str): Type of crop (Soybean, Corn, Cotton)
-        weather_prediction (dict): Weather forecast data from predict_future_weather
+        weather_prediction (dict, optional): Weather forecast data from predict_future_weather. If None, will predict it from
+            the climate normals and the current weather at the coordinates.
         soil_data (dict, optional): Soil information. If None, will fetch using coordinates.
         latitude (float, optional): Latitude coordinate for fetching soil data
         longitude (float, optional): Longitude coordinate for fetching soil data
@@ -48,19 +53,27 @@ def recommend_products(crop_type, weather_prediction, soil_data=None, latitude=N
                 "soil_nutrients": 0.05
             }
 
+    if weather_prediction is None and latitude is not None and longitude is not None:
+        try:
+            weather_prediction = forecast_for(latitude, longitude, RECOMMENDATION_HORIZON_DAYS)
+        except Exception as e:
+            print(f"Error predicting weather: {e}")
+    weather_prediction = weather_prediction or {}
+
     calculation_results = {}
     if latitude is not None and longitude is not None:
         try:
             # Calculate stress factors using the scientific formulas
-            calculation_results["daytime_heat_stress"] = calculate_daytime_heat_stress_risk(latitude, longitude, crop_type.lower())
-            calculation_results["nighttime_heat_stress"] = calculate_nighttime_heat_stress_risk(latitude, longitude, crop_type.lower())
-            calculation_results["frost_stress"] = calculate_frost_stress(latitude, longitude, crop_type.lower())
-            calculation_results["drought_risk"] = get_drought_risk(latitude, longitude)
+            context = create_context(latitude, longitude)
+            calculation_results["daytime_heat_stress"] = get_daytime_heat_stress_risk(context, crop_type.lower())
+            calculation_results["nighttime_heat_stress"] = get_nighttime_heat_stress_risk(context, crop_type.lower())
+            calculation_results["frost_stress"] = get_frost_stress(context, crop_type.lower())
+            calculation_results["drought_risk"] = get_drought_risk(context)
             
             # Get date range for yield calculations
             start = datetime.now() - timedelta(days=90)
             end = datetime.now() + timedelta(days=14) 
-            calculation_results["yield_risk"] = get_yield_risk(latitude, longitude, start, end, crop_type.lower())
+            calculation_results["yield_risk"] = get_yield_risk(context, crop_type.lower(), start, end)
         except Exception as e:
             print(f"Error performing calculations: {e}")
             
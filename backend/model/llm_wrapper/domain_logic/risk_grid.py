@@ -0,0 +1,154 @@
+"""
+Precomputed risk scores on a regular grid over the Brazilian states
+
+The grid is built nightly by risk_grid_job and stored as one float32 array
+of shape (crops, risks, rows, columns) in an .npz file, NaN where a cell has
+no score. Cell (i, j) is centered on the grid point ((origin_row + i) *
+step, (origin_column + j) * step), like the cells of grid.grid_cell, so at
+the native step every cell is scored from the values of one grid point of
+the weather inputs. Lookups interpolate between cell centers
+or take the nearest cell and return None when the point is outside the grid,
+the cell has no score or the grid is older than RISK_GRID_MAX_AGE_HOURS,
+so callers fall back to upstream.
+"""
+
+import math
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+RISKS = (
+    "daytime_heat_stress_risk",
+    "nighttime_heat_stress_risk",
+    "frost_stress",
+    "drought_risk",
+    "yield_risk",
+)
+DEFAULT_PATH = Path(__file__).parent.parent / "data" / "risk_grid.npz"
+
+_grid = None
+_grid_mtime = None
+_grid_lock = threading.Lock()
+
+
+def risk_grid_path():
+    return Path(os.getenv("RISK_GRID_PATH", str(DEFAULT_PATH)))
+
+
+def max_age():
+    return timedelta(hours=float(os.getenv("RISK_GRID_MAX_AGE_HOURS", 36)))
+
+
+def interpolation():
+    """
+    "bilinear" or "nearest"
+    """
+    return os.getenv("RISK_GRID_INTERPOLATION", "bilinear")
+
+
+class RiskGrid:
+    def __init__(self, scores, origin_row, origin_column, step, crops, built_at):
+        self.scores = scores
+        self.origin_row = origin_row
+        self.origin_column = origin_column
+        self.step = step
+        self.crops = {crop: index for index, crop in enumerate(crops)}
+        self.built_at = built_at
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as stored:
+            return cls(
+                stored["scores"],
+                int(stored["origin"][0]),
+                int(stored["origin"][1]),
+                float(stored["step"]),
+                [str(crop) for crop in stored["crops"]],
+                datetime.fromisoformat(str(stored["built_at"])),
+            )
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(".tmp.npz")
+        np.savez(
+            temporary,
+            scores=self.scores,
+            origin=np.array([self.origin_row, self.origin_column]),
+            step=np.array(self.step),
+            crops=np.array(list(self.crops)),
+            built_at=np.array(self.built_at.isoformat()),
+        )
+        os.replace(temporary, path)
+
+    def cell_center(self, row, column):
+        return (
+            round((self.origin_row + row) * self.step, 6),
+            round((self.origin_column + column) * self.step, 6),
+        )
+
+    def is_fresh(self, now=None):
+        return (now or datetime.now()) - self.built_at <= max_age()
+
+    def lookup(self, latitude, longitude, crop_type, method=None):
+        """
+        Returns the five risk scores of RISKS at the point or None
+        """
+        crop = self.crops.get(crop_type)
+        if crop is None:
+            return None
+        scores = self.scores[crop]
+        rows, columns = scores.shape[1:]
+        # Fractional index relative to the cell centers
+        y = latitude / self.step - self.origin_row
+        x = longitude / self.step - self.origin_column
+
+        if (method or interpolation()) == "bilinear":
+            row, column = math.floor(y), math.floor(x)
+            if 0 <= row < rows - 1 and 0 <= column < columns - 1:
+                dy, dx = y - row, x - column
+                corners = scores[:, row : row + 2, column : column + 2]
+                weights = np.array(
+                    [[(1 - dy) * (1 - dx), (1 - dy) * dx], [dy * (1 - dx), dy * dx]]
+                )
+                # Near cells without scores the nearest cell is used instead
+                if not np.isnan(corners).any():
+                    return tuple(
+                        float(value) for value in (corners * weights).sum(axis=(1, 2))
+                    )
+
+        row, column = math.floor(y + 0.5), math.floor(x + 0.5)
+        if not (0 <= row < rows and 0 <= column < columns):
+            return None
+        cell = scores[:, row, column]
+        if np.isnan(cell).any():
+            return None
+        return tuple(float(value) for value in cell)
+
+
+def get_risk_grid():
+    """
+    Returns the stored RiskGrid, reloaded when the file changes, or None
+    when there is no fresh grid
+    """
+    global _grid, _grid_mtime
+    path = risk_grid_path()
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None
+    if mtime != _grid_mtime:
+        with _grid_lock:
+            if mtime != _grid_mtime:
+                try:
+                    _grid = RiskGrid.load(path)
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Error loading risk grid {path}: {e}")
+                    _grid = None
+                _grid_mtime = mtime
+    if _grid is None or not _grid.is_fresh():
+        return None
+    return _grid
@@ -0,0 +1,128 @@
+"""
+Nightly build of the precomputed risk grid
+
+Every cell whose center lies in a state, plus a margin of one cell so that
+bilinear lookups near the borders have all four corners, is scored for
+every crop through the batch MultiPoint path, one vectorized pass per
+request. Run it from a scheduler with
+
+    python -m model.llm_wrapper.domain_logic.risk_grid_job
+
+or set RISK_GRID_BUILD_HOUR to have the backend rebuild it every night.
+"""
+
+import asyncio
+import math
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import shapely
+
+from model.llm_wrapper.domain_logic.batch_risk_stats import get_batch_scores
+from model.llm_wrapper.domain_logic.crop_parameters import CROPS
+from model.llm_wrapper.domain_logic.risk_grid import RISKS, RiskGrid, risk_grid_path
+from model.llm_wrapper.services.grid import resolution
+from model.llm_wrapper.services.state_index import get_state_index
+
+# Default step is the native grid of the weather inputs
+RISK_GRID_DOMAIN = "NEMSGLOBAL"
+
+
+def risk_grid_step():
+    return float(os.getenv("RISK_GRID_STEP", resolution(RISK_GRID_DOMAIN)))
+
+
+def build_hour():
+    hour = os.getenv("RISK_GRID_BUILD_HOUR")
+    return None if hour is None else int(hour)
+
+
+def covered_region(step, state_index):
+    """
+    Returns (origin_row, origin_column, latitudes, longitudes, covered) of
+    the grid of step over the states, covered is a (rows, columns) mask of
+    the cells in a state and their neighbours
+    """
+    min_longitude, min_latitude, max_longitude, max_latitude = shapely.total_bounds(
+        state_index.geometries
+    )
+
+    origin_row = math.floor(min_latitude / step) - 1
+    origin_column = math.floor(min_longitude / step) - 1
+    rows = math.floor(max_latitude / step) + 2 - origin_row
+    columns = math.floor(max_longitude / step) + 2 - origin_column
+    latitudes = np.round((origin_row + np.arange(rows)) * step, 6)
+    longitudes = np.round((origin_column + np.arange(columns)) * step, 6)
+    latitude_grid, longitude_grid = np.meshgrid(latitudes, longitudes, indexing="ij")
+    inside = state_index.lookup(latitude_grid, longitude_grid) >= 0
+    covered = inside.copy()
+    covered[1:] |= inside[:-1]
+    covered[:-1] |= inside[1:]
+    covered[:, 1:] |= covered[:, :-1].copy()
+    covered[:, :-1] |= covered[:, 1:].copy()
+    return origin_row, origin_column, latitudes, longitudes, covered
+
+
+def build_risk_grid(step=None, state_index=None):
+    step = step or risk_grid_step()
+    origin_row, origin_column, latitudes, longitudes, covered = covered_region(
+        step, state_index or get_state_index()
+    )
+    grid = RiskGrid(
+        np.full((len(CROPS), len(RISKS), *covered.shape), np.nan, dtype=np.float32),
+        origin_row,
+        origin_column,
+        step,
+        CROPS,
+        datetime.now(),
+    )
+
+    cells = np.array(
+        [
+            (row, column, crop)
+            for row, column in np.argwhere(covered)
+            for crop in range(len(CROPS))
+        ]
+    ).reshape(-1, 3)
+    records = [
+        (float(latitudes[row]), float(longitudes[column]), CROPS[crop])
+        for row, column, crop in cells
+    ]
+    failed = 0
+    scored = 0
+    for chunk, scores, _ in get_batch_scores(records):
+        row, column, crop = cells[scored : scored + len(chunk)].T
+        grid.scores[crop, :, row, column] = scores
+        failed += int((~np.isfinite(scores).all(axis=1)).sum())
+        scored += len(chunk)
+    if failed:
+        print(f"Risk grid: {failed} of {len(records)} cells could not be scored")
+    return grid
+
+
+def build_and_save():
+    grid = build_risk_grid()
+    grid.save(risk_grid_path())
+    scored = int(np.isfinite(grid.scores).all(axis=1).sum())
+    print(f"Risk grid: saved {scored} scored cells to {risk_grid_path()}")
+
+
+async def run_nightly(hour):
+    """
+    Rebuilds the grid every day at hour, in a worker thread
+    """
+    while True:
+        now = datetime.now()
+        next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+        try:
+            await asyncio.to_thread(build_and_save)
+        except Exception as e:
+            print(f"Error building risk grid: {e}")
+
+
+if __name__ == "__main__":
+    build_and_save()
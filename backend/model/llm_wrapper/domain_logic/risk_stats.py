@@ -1,10 +1,43 @@
+"""
+Risk stats of a field
+
+get_stats and get_stats_async take an optional latency budget in seconds.
+It bounds every upstream call made for the field. When it runs out, the
+risks that finished are returned. The other risks are served from the last
+value computed for the field cell and crop, listed under "stale", or
+flagged "unavailable". The recommended products are computed over the risks
+that have a value. Stats served from the risk grid have the same keys, with
+every risk listed under "stale" when the grid was built before today.
+
+    RISK_STATS_CACHE_SIZE   field cells x crops of last values kept (default 10000)
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import httpx
+import requests
+
+import model.llm_wrapper.services.http_client as http_client
+import model.llm_wrapper.domain_logic.async_calculations as async_calculations
 from model.llm_wrapper.domain_logic.calculations import (
+    create_context,
+    get_risk_series,
     get_daytime_heat_stress_risk,
     get_nighttime_heat_stress_risk,
     get_frost_stress,
     get_drought_risk,
     get_yield_risk,
 )
+from model.llm_wrapper.domain_logic.risk_grid import RISKS, get_risk_grid
+from model.llm_wrapper.services.field_registry import field_cell
+from model.llm_wrapper.services.resilience import deadline_after, time_left
+
+logger = logging.getLogger(__name__)
 
 OPTIMAL_DAYTIME_HEAT_STRESS_RISK = "0"
 WORST_DAYTIME_HEAT_STRESS_RISK = "9"
@@ -17,22 +50,141 @@ WORST_DROUGHT_RISK = "<0"
 OPTIMAL_YIELD_RISK = "0"
 WORST_YIELD_RISK = ">1000"
 
+UNAVAILABLE = "unavailable"
+
+_last_scores = OrderedDict()
+_last_scores_lock = threading.Lock()
+
+
+def last_scores_size():
+    return int(os.getenv("RISK_STATS_CACHE_SIZE", 10000))
 
-def get_stats(latitude, longitude, crop_type):
-    daytime_heat_stress_risk = round(
-        get_daytime_heat_stress_risk(latitude, longitude, crop_type), 2
-    )
 
-    nighttime_heat_stress_risk = round(
-        get_nighttime_heat_stress_risk(latitude, longitude, crop_type), 2
+def get_stats(latitude, longitude, crop_type, budget=None):
+    stats = get_gridded_stats(latitude, longitude, crop_type)
+    if stats is not None:
+        return stats
+    with deadline_after(budget):
+        context = create_context(latitude, longitude)
+        # One planned request for everything, the calculations then read the memo
+        try:
+            context.prefetch(get_risk_series(context))
+        except requests.RequestException as e:
+            logger.warning("Error prefetching risk series: %s", e)
+        calculations = (
+            lambda: get_daytime_heat_stress_risk(context, crop_type),
+            lambda: get_nighttime_heat_stress_risk(context, crop_type),
+            lambda: get_frost_stress(context, crop_type),
+            lambda: get_drought_risk(context),
+            lambda: get_yield_risk(context, crop_type),
+        )
+        scores = []
+        for risk, calculate in zip(RISKS, calculations):
+            try:
+                scores.append(round(calculate(), 2))
+            except requests.RequestException as e:
+                logger.warning("Error calculating %s: %s", risk, e)
+                scores.append(None)
+    return build_available_stats(latitude, longitude, crop_type, scores)
+
+
+async def get_stats_async(latitude, longitude, crop_type, budget=None):
+    stats = get_gridded_stats(latitude, longitude, crop_type)
+    if stats is not None:
+        return stats
+    context = async_calculations.create_context(
+        http_client.get_async_client(), latitude, longitude
     )
+    # The tasks inherit the deadline
+    with deadline_after(budget):
+        # One planned request for everything, the calculations then await it
+        try:
+            await asyncio.wait_for(
+                context.prefetch(get_risk_series(context)), time_left()
+            )
+        except (asyncio.TimeoutError, httpx.HTTPError, requests.RequestException) as e:
+            logger.warning("Error prefetching risk series: %r", e)
+        tasks = [
+            asyncio.ensure_future(calculation)
+            for calculation in (
+                async_calculations.get_daytime_heat_stress_risk(context, crop_type),
+                async_calculations.get_nighttime_heat_stress_risk(context, crop_type),
+                async_calculations.get_frost_stress(context, crop_type),
+                async_calculations.get_drought_risk(context),
+                async_calculations.get_yield_risk(context, crop_type),
+            )
+        ]
+        _, pending = await asyncio.wait(tasks, timeout=time_left())
+    for task in pending:
+        task.cancel()
+
+    scores = []
+    for risk, task in zip(RISKS, tasks):
+        if task in pending:
+            logger.warning("Error calculating %s: deadline exceeded", risk)
+            scores.append(None)
+        elif isinstance(task.exception(), (httpx.HTTPError, requests.RequestException)):
+            logger.warning("Error calculating %s: %s", risk, task.exception())
+            scores.append(None)
+        else:
+            scores.append(round(task.result(), 2))
+    return build_available_stats(latitude, longitude, crop_type, scores)
 
-    frost_stress = round(get_frost_stress(latitude, longitude, crop_type), 2)
 
-    drought_risk = round(get_drought_risk(latitude, longitude), 2)
+def build_available_stats(latitude, longitude, crop_type, scores):
+    """
+    Builds the stats of the scores that finished, scores of None are taken
+    from the last value of the field cell or flagged unavailable
+    """
+    key = (*field_cell(latitude, longitude), crop_type)
+    with _last_scores_lock:
+        last = _last_scores.get(key, (None,) * len(RISKS))
+        merged = tuple(
+            last_score if score is None else score
+            for score, last_score in zip(scores, last)
+        )
+        _last_scores[key] = merged
+        _last_scores.move_to_end(key)
+        while len(_last_scores) > last_scores_size():
+            _last_scores.popitem(last=False)
+
+    stats = build_stats(*merged)
+    stats["stale"] = [
+        risk
+        for risk, score, last_score in zip(RISKS, scores, merged)
+        if score is None and last_score is not None
+    ]
+    stats["unavailable"] = [risk for risk, score in zip(RISKS, merged) if score is None]
+    return stats
+
+
+def get_gridded_stats(latitude, longitude, crop_type):
+    """
+    Returns the stats from the precomputed risk grid, None when the point
+    has to be evaluated upstream
+    """
+    risk_grid = get_risk_grid()
+    if risk_grid is None:
+        return None
+    scores = risk_grid.lookup(latitude, longitude, crop_type)
+    if scores is None:
+        return None
+    stats = build_stats(*(round(score, 2) for score in scores))
+    # A grid of a previous day still scores the windows of that day
+    stats["stale"] = (
+        [] if risk_grid.built_at.date() == datetime.now().date() else list(RISKS)
+    )
+    stats["unavailable"] = []
+    return stats
 
-    yield_risk = round(get_yield_risk(latitude, longitude, crop_type), 2)
 
+def build_stats(
+    daytime_heat_stress_risk,
+    nighttime_heat_stress_risk,
+    frost_stress,
+    drought_risk,
+    yield_risk,
+):
     stats = {
         "daytime_heat_stress_risk": [
             get_daytime_heat_stress_risk_level(daytime_heat_stress_risk),
@@ -81,13 +233,14 @@ def get_recommended_products(stats):
             "drought_risk",
         ] and (value[0] == "medium" or value[0] == "high"):
             recommended.append("stress_buster")
-        print(key)
         if key == "yield_risk" and (value[0] == "medium" or value[0] == "high"):
             recommended.append("yield_booster")
     return recommended
 
 
 def get_daytime_heat_stress_risk_level(value):
+    if value is None:
+        return UNAVAILABLE
     if value < 3:
         return "low"
     if value < 6:
@@ -97,6 +250,8 @@ def get_daytime_heat_stress_risk_level(value):
 
 
 def get_nighttime_heat_stress_risk_level(value):
+    if value is None:
+        return UNAVAILABLE
     if value < 3:
         return "low"
     if value < 6:
@@ -106,6 +261,8 @@ def get_nighttime_heat_stress_risk_level(value):
 
 
 def get_frost_stress_risk_level(value):
+    if value is None:
+        return UNAVAILABLE
     if value < 3:
         return "low"
     if value < 6:
@@ -115,6 +272,8 @@ def get_frost_stress_risk_level(value):
 
 
 def get_drought_risk_level(value):
+    if value is None:
+        return UNAVAILABLE
     if value >= 1.3:
         return "low"
     if 1.3 > value > 0.7:
@@ -124,6 +283,8 @@ def get_drought_risk_level(value):
 
 
 def get_yield_risk_level(value):
+    if value is None:
+        return UNAVAILABLE
     if value < 250:
         return "low"
     if 250 <= value <= 600:
@@ -0,0 +1,160 @@
+"""
+NumPy variant of the risk scoring in calculations.py and risk_stats.py
+
+Every function takes arrays of inputs, one element per field or field-day,
+and crop_types as an array of crop names or crop_parameters indices.
+Scores come back as float64 arrays, levels as object arrays of "low",
+"medium", "high", or None where the scalar classifier has no level.
+"""
+
+import numpy as np
+
+from model.llm_wrapper.domain_logic.calculations import YIELD_RISK_WEIGHTS
+from model.llm_wrapper.domain_logic.crop_parameters import (
+    get_crop_columns,
+    get_crop_indices,
+)
+
+LEVELS = np.array(["low", "medium", "high", None], dtype=object)
+LOW, MEDIUM, HIGH, NO_LEVEL = range(4)
+
+
+def calculate_daytime_heat_stress_risk(t_max, crop_types):
+    t_max_optimum, t_max_limit = get_crop_columns(
+        get_crop_indices(crop_types), "t_max_optimum", "t_max_limit"
+    )
+    return 9 * np.clip(
+        (np.asarray(t_max, dtype=np.float64) - t_max_optimum)
+        / (t_max_limit - t_max_optimum),
+        0,
+        1,
+    )
+
+
+def calculate_nighttime_heat_stress_risk(t_min, crop_types):
+    t_min_optimum, t_min_limit = get_crop_columns(
+        get_crop_indices(crop_types), "t_min_optimum", "t_min_limit"
+    )
+    return 9 * np.clip(
+        (np.asarray(t_min, dtype=np.float64) - t_min_optimum)
+        / (t_min_limit - t_min_optimum),
+        0,
+        1,
+    )
+
+
+def calculate_frost_stress(t_min, crop_types):
+    t_min_no_frost, t_min_frost = get_crop_columns(
+        get_crop_indices(crop_types), "t_min_no_frost", "t_min_frost"
+    )
+    t_min = np.asarray(t_min, dtype=np.float64)
+    stress = 9 * np.abs(t_min - t_min_frost) / np.abs(t_min_frost - t_min_no_frost)
+    stress = np.where(t_min <= t_min_frost, 9.0, stress)
+    return np.where(t_min >= t_min_no_frost, 0.0, stress)
+
+
+def calculate_drought_risk(
+    cumulative_rainfall, cumulative_evaporation, soil_moisture, average_temperature
+):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (
+            np.asarray(cumulative_rainfall, dtype=np.float64) - cumulative_evaporation
+        ) + np.asarray(soil_moisture, dtype=np.float64) / average_temperature
+
+
+def calculate_yield_risk(
+    growing_degree_days, cumulative_rainfall, soil_ph, soil_nitrogen, crop_types
+):
+    (
+        optimal_growing_degree_days,
+        optimal_rainfall,
+        optimal_soil_ph,
+        optimal_soil_nitrogen,
+    ) = get_crop_columns(
+        get_crop_indices(crop_types),
+        "optimal_growing_degree_days",
+        "optimal_rainfall",
+        "optimal_soil_ph",
+        "optimal_soil_nitrogen",
+    )
+
+    w1, w2, w3, w4 = YIELD_RISK_WEIGHTS
+
+    return np.abs(
+        w1 * (np.asarray(growing_degree_days) - optimal_growing_degree_days) * 2
+        + w2 * (np.asarray(cumulative_rainfall) - optimal_rainfall) * 2
+        + w3 * (np.asarray(soil_ph) - optimal_soil_ph) * 2
+        + w4 * (np.asarray(soil_nitrogen) - optimal_soil_nitrogen) * 2
+    )
+
+
+def get_stress_level(values):
+    """
+    Shared by the daytime heat, nighttime heat and frost stress levels
+    """
+    values = np.asarray(values, dtype=np.float64)
+    levels = np.digitize(values, [3, 6])
+    return LEVELS[np.where(values <= 9, levels, NO_LEVEL)]
+
+
+get_daytime_heat_stress_risk_level = get_stress_level
+get_nighttime_heat_stress_risk_level = get_stress_level
+get_frost_stress_risk_level = get_stress_level
+
+
+def get_drought_risk_level(values):
+    values = np.asarray(values, dtype=np.float64)
+    levels = np.where(values >= 1.3, LOW, np.where(values > 0.7, MEDIUM, HIGH))
+    return LEVELS[np.where(np.isnan(values), NO_LEVEL, levels)]
+
+
+def get_yield_risk_level(values):
+    values = np.asarray(values, dtype=np.float64)
+    levels = np.where(values < 250, LOW, np.where(values <= 600, MEDIUM, HIGH))
+    return LEVELS[np.where(np.isnan(values), NO_LEVEL, levels)]
+
+
+def calculate_risks(
+    t_max,
+    t_min,
+    cumulative_rainfall,
+    cumulative_evaporation,
+    soil_moisture,
+    average_temperature,
+    growing_degree_days,
+    soil_ph,
+    soil_nitrogen,
+    crop_types,
+):
+    """
+    Returns {risk name: (scores, levels)} for the five risks of risk_stats
+    """
+    crop_indices = get_crop_indices(crop_types)
+    frost_stress = calculate_frost_stress(t_min, crop_indices)
+    drought_risk = calculate_drought_risk(
+        cumulative_rainfall, cumulative_evaporation, soil_moisture, average_temperature
+    )
+    yield_risk = calculate_yield_risk(
+        growing_degree_days,
+        cumulative_rainfall,
+        soil_ph,
+        soil_nitrogen,
+        crop_indices,
+    )
+    daytime_heat_stress_risk = calculate_daytime_heat_stress_risk(t_max, crop_indices)
+    nighttime_heat_stress_risk = calculate_nighttime_heat_stress_risk(
+        t_min, crop_indices
+    )
+    return {
+        "daytime_heat_stress_risk": (
+            daytime_heat_stress_risk,
+            get_daytime_heat_stress_risk_level(daytime_heat_stress_risk),
+        ),
+        "nighttime_heat_stress_risk": (
+            nighttime_heat_stress_risk,
+            get_nighttime_heat_stress_risk_level(nighttime_heat_stress_risk),
+        ),
+        "frost_stress": (frost_stress, get_frost_stress_risk_level(frost_stress)),
+        "drought_risk": (drought_risk, get_drought_risk_level(drought_risk)),
+        "yield_risk": (yield_risk, get_yield_risk_level(yield_risk)),
+    }
@@ -0,0 +1,214 @@
+"""
+Weather prediction for several horizons at once
+
+Where the climate normals cover the point (see climatology), today's
+weather is blended with them: the anomaly of today's daily value against
+today's normal decays with the horizon, by a factor of 1/e every
+NOWCAST_PERSISTENCE_DAYS, on top of the normal of the target day. The
+expected variance grows from zero to the climatological variance with the
+horizon. Today's values are the daily aggregates the normals are built
+from, observed hours and forecast for the rest of the day, fetched with one
+dataset request through the series archive. An instantaneous nowcast would
+carry the time of day into the anomaly, e.g. an afternoon temperature
+several degrees above the daily mean. Wind direction has no normal and is
+only predicted from the analog years.
+
+Elsewhere the current weather and the analog years (see
+analog_weather_service) are fetched concurrently. Every parameter and
+horizon is then predicted in one NumPy pass: the weighted average of the
+current value and the values one and two years ago, plus the trend between
+the two analog years scaled by the horizon. The confidence of a parameter
+falls with the variance of its three values and does not depend on the
+horizon.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from model.llm_wrapper.domain_logic.calculations import create_context
+from model.llm_wrapper.domain_logic.climatology import daily_series, get_climatology
+from model.llm_wrapper.services.analog_weather_service import (
+    get_analog_years,
+    window_means,
+)
+from model.llm_wrapper.services.current_weather_service import get_current_weather
+
+PARAMETERS = (
+    "temperature",
+    "humidity",
+    "wind_speed",
+    "wind_direction",
+    "precipitation",
+)
+# Current, one year ago, two years ago
+WEIGHTS = np.array([0.5, 0.3, 0.2])
+
+
+def nowcast_persistence_days():
+    return float(os.getenv("NOWCAST_PERSISTENCE_DAYS", 2))
+
+
+def fetch_sources(latitude, longitude):
+    """
+    Returns [current, one_year_ago, two_years_ago] as {parameter: value}
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        current = executor.submit(get_current_weather, latitude, longitude)
+        analog = executor.submit(get_analog_years, latitude, longitude, 2)
+        try:
+            analog_years = [window_means(year) for year in analog.result()]
+        except Exception as e:
+            print(f"Error fetching analog years: {e}")
+            analog_years = [{}, {}]
+        return [current.result(), *analog_years]
+
+
+def as_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def predict_horizons(sources, horizons):
+    """
+    Returns (parameters, predicted, confidence), arrays of (parameters,
+    horizons), confidence in percent
+    """
+    rows = {
+        parameter: [as_number(source.get(parameter)) for source in sources]
+        for parameter in PARAMETERS
+    }
+    parameters = [
+        parameter
+        for parameter, row in rows.items()
+        if all(value is not None for value in row)
+    ]
+    values = np.array([rows[parameter] for parameter in parameters]).reshape(
+        len(parameters), len(WEIGHTS)
+    )
+    horizons = np.asarray(horizons, dtype=np.float64)
+
+    seasonal_trend = (values[:, 1] - values[:, 2]) / 365
+    predicted = (values @ WEIGHTS)[:, None] + seasonal_trend[:, None] * horizons
+
+    # Higher variance = lower confidence, against an arbitrary threshold of
+    # half the largest value
+    with np.errstate(divide="ignore", invalid="ignore"):
+        confidence = 100 * (1 - values.var(axis=1) / (values.max(axis=1) * 0.5))
+    confidence = np.clip(np.nan_to_num(confidence, nan=100.0), 0, 100)
+    return parameters, predicted, np.repeat(confidence[:, None], len(horizons), 1)
+
+
+def fetch_today(latitude, longitude, variables, now):
+    """
+    Returns {variable: today's daily value}, NaN where it is missing
+    """
+    context = create_context(latitude, longitude, now)
+    requirements = [(daily_series(variable), now, now) for variable in variables]
+    context.prefetch(requirements, soil=False)
+    return {
+        variable: context.mean(series, start, end)
+        for variable, (series, start, end) in zip(variables, requirements)
+    }
+
+
+def blend_normals(variables, normals, today, horizons):
+    """
+    Returns (parameters, predicted, confidence) like predict_horizons from
+    normals (today and every horizon, variables, [mean, variance]) and
+    today's daily values
+    """
+    mean = normals[..., 0].T.astype(np.float64)
+    variance = normals[..., 1].T.astype(np.float64)
+    anomaly = np.zeros(len(variables))
+    for index, variable in enumerate(variables):
+        value = as_number(today.get(variable))
+        if value is not None and not np.isnan(value):
+            anomaly[index] = value - mean[index, 0]
+    decay = np.exp(-np.asarray(horizons, dtype=np.float64) / nowcast_persistence_days())
+
+    predicted = mean[:, 1:] + anomaly[:, None] * decay
+    expected_variance = variance[:, 1:] * (1 - decay**2)
+    # Same threshold as predict_horizons, half the predicted value
+    with np.errstate(divide="ignore", invalid="ignore"):
+        confidence = 100 * (1 - expected_variance / (np.abs(predicted) * 0.5))
+    confidence = np.clip(np.nan_to_num(confidence, nan=100.0), 0, 100)
+    return list(variables), predicted, confidence
+
+
+def predict_from_normals(latitude, longitude, horizons, now):
+    """
+    Returns (parameters, predicted, confidence) or None when the normals do
+    not cover the point
+    """
+    climatology = get_climatology()
+    if climatology is None:
+        return None
+    days = [(now + timedelta(days=days_ahead)).date() for days_ahead in [0, *horizons]]
+    normals = climatology.lookup(latitude, longitude, days)
+    if normals is None:
+        return None
+    try:
+        today = fetch_today(latitude, longitude, climatology.variables, now)
+    except Exception as e:
+        # The normals alone are still a forecast
+        print(f"Error fetching today's weather: {e}")
+        today = {}
+    return blend_normals(climatology.variables, normals, today, horizons)
+
+
+def predict_weather(latitude, longitude, horizons, now=None):
+    """
+    Returns the prediction table of days ahead in horizons:
+    {"horizons", "target_dates", "parameters", "forecast", "confidence",
+    "source"}, forecast and confidence have one row per parameter and one
+    column per horizon, source is "normals" or "analog_years"
+    """
+    now = now or datetime.now()
+    source = "normals"
+    prediction = predict_from_normals(latitude, longitude, horizons, now)
+    if prediction is None:
+        source = "analog_years"
+        prediction = predict_horizons(fetch_sources(latitude, longitude), horizons)
+    parameters, predicted, confidence = prediction
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "prediction_created": now.isoformat(),
+        "horizons": list(horizons),
+        "target_dates": [
+            (now + timedelta(days=days_ahead)).strftime("%Y-%m-%d")
+            for days_ahead in horizons
+        ],
+        "parameters": parameters,
+        "forecast": np.round(predicted, 2).tolist(),
+        "confidence": np.round(confidence).astype(int).tolist(),
+        "source": source,
+    }
+
+
+def forecast_for(latitude, longitude, days_ahead, now=None):
+    """
+    Returns the prediction of one day in the format of
+    predict_future_weather: {"target_date", "forecast": {parameter,
+    parameter_confidence}, ...}
+    """
+    table = predict_weather(latitude, longitude, [days_ahead], now)
+    forecast = {}
+    for parameter, values, confidence in zip(
+        table["parameters"], table["forecast"], table["confidence"]
+    ):
+        forecast[parameter] = values[0]
+        forecast[f"{parameter}_confidence"] = confidence[0]
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "target_date": table["target_dates"][0],
+        "prediction_created": table["prediction_created"],
+        "forecast": forecast,
+        "source": table["source"],
+    }
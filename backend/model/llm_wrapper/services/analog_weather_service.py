@@ -0,0 +1,246 @@
+"""
+Weather of the same calendar window in past years ("analog years")
+
+For N years back, the window of days_before..days_after around today is
+shifted into each year and all years are sent as the time intervals of one
+hourly Meteoblue request. Every variable is reduced per year to the window
+mean, sum, max and min (a circular mean, no sum, for wind direction).
+
+Windows that ended before the final lag of the domain (see series_archive)
+never change upstream, so their aggregates are kept permanently in SQLite,
+keyed by the NEMSGLOBAL cell and the window dates; only years not cached
+yet are requested.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from model.llm_wrapper.services.grid import grid_cell, snap
+from model.llm_wrapper.services.meteoblue_dataset import get_query
+from model.llm_wrapper.services.meteoblue_model import (
+    MeteoblueQuery,
+    format_time_interval,
+)
+from model.llm_wrapper.services.series_archive import final_lag_days
+
+ANALOG_DOMAIN = "NEMSGLOBAL"
+ANALOG_CODES = {
+    "temperature": {"code": 11, "level": "2 m above gnd"},
+    "humidity": {"code": 52, "level": "2 m above gnd"},
+    "wind_speed": {"code": 32, "level": "10 m above gnd"},
+    "wind_direction": {"code": 31, "level": "10 m above gnd"},
+    "precipitation": {"code": 61, "level": "sfc"},
+}
+CIRCULAR = {"wind_direction"}
+AGGREGATES = ("mean", "sum", "max", "min")
+DEFAULT_PATH = Path(__file__).parent.parent / "data" / "analog_cache.sqlite3"
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def shift_year(day, years_back):
+    """
+    Returns day years_back years earlier, February 29 becomes February 28
+    """
+    try:
+        return day.replace(year=day.year - years_back)
+    except ValueError:
+        return day.replace(year=day.year - years_back, day=28)
+
+
+def analog_windows(years, days_before, days_after, today):
+    """
+    Returns [(years_back, start, end)] for 1..years years back
+    """
+    windows = []
+    for years_back in range(1, years + 1):
+        center = shift_year(today, years_back)
+        windows.append(
+            (
+                years_back,
+                center - timedelta(days=days_before),
+                center + timedelta(days=days_after),
+            )
+        )
+    return windows
+
+
+def aggregate_window(values, circular=False):
+    """
+    Returns {aggregate: value} of an hourly window, None for empty windows
+    """
+    present = values[~np.isnan(values)].astype(np.float64)
+    if not len(present):
+        return dict.fromkeys(AGGREGATES)
+    if circular:
+        radians = np.radians(present)
+        mean = math.degrees(math.atan2(np.sin(radians).mean(), np.cos(radians).mean()))
+        return {
+            "mean": round(mean % 360, 2),
+            "sum": None,
+            "max": round(float(present.max()), 2),
+            "min": round(float(present.min()), 2),
+        }
+    return {
+        "mean": round(float(present.mean()), 2),
+        "sum": round(float(present.sum()), 2),
+        "max": round(float(present.max()), 2),
+        "min": round(float(present.min()), 2),
+    }
+
+
+class AnalogCache:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS analog (
+                row INTEGER NOT NULL,
+                col INTEGER NOT NULL,
+                start TEXT NOT NULL,
+                end TEXT NOT NULL,
+                variable TEXT NOT NULL,
+                mean REAL,
+                sum REAL,
+                max REAL,
+                min REAL,
+                PRIMARY KEY (row, col, start, end, variable)
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.commit()
+        self.lock = threading.Lock()
+
+    def get(self, latitude, longitude, start, end):
+        """
+        Returns {variable: {aggregate: value}} of a window or None
+        """
+        _, row, column = grid_cell(latitude, longitude, ANALOG_DOMAIN)
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT variable, mean, sum, max, min FROM analog "
+                "WHERE row = ? AND col = ? AND start = ? AND end = ?",
+                (row, column, start.isoformat(), end.isoformat()),
+            ).fetchall()
+        if len(rows) < len(ANALOG_CODES):
+            return None
+        return {variable: dict(zip(AGGREGATES, values)) for variable, *values in rows}
+
+    def put(self, latitude, longitude, start, end, weather):
+        _, row, column = grid_cell(latitude, longitude, ANALOG_DOMAIN)
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO analog VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        row,
+                        column,
+                        start.isoformat(),
+                        end.isoformat(),
+                        variable,
+                        *(aggregates[name] for name in AGGREGATES),
+                    )
+                    for variable, aggregates in weather.items()
+                ],
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def get_analog_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnalogCache(os.getenv("ANALOG_CACHE_PATH", str(DEFAULT_PATH)))
+    return _cache
+
+
+def fetch_analog_windows(latitude, longitude, windows):
+    """
+    Returns {(start, end): weather} of [(start, end)] with one request
+    """
+    intervals = {window: format_time_interval(*window) for window in windows}
+    query = (
+        MeteoblueQuery()
+        .with_coordinates(*snap(latitude, longitude, ANALOG_DOMAIN))
+        .with_time_intervals(intervals.values())
+        .with_codes(ANALOG_DOMAIN, None, "hourly", ANALOG_CODES.values())
+    )
+    decoded = get_query(query)
+    return {
+        window: {
+            variable: aggregate_window(
+                decoded.series(
+                    ANALOG_DOMAIN, None, "hourly", code_dict, interval
+                ).values[0],
+                circular=variable in CIRCULAR,
+            )
+            for variable, code_dict in ANALOG_CODES.items()
+        }
+        for window, interval in intervals.items()
+    }
+
+
+def get_analog_years(
+    latitude, longitude, years=2, days_before=3, days_after=3, today=None
+):
+    """
+    Returns [{"year", "years_back", "start", "end", "weather"}] for 1..years
+    years back, weather is {variable: {"mean", "sum", "max", "min"}}
+    """
+    today = today or date.today()
+    final_before = today - timedelta(days=final_lag_days(ANALOG_DOMAIN))
+    cache = get_analog_cache()
+
+    weather = {}
+    missing = []
+    for _, start, end in analog_windows(years, days_before, days_after, today):
+        cached = cache.get(latitude, longitude, start, end)
+        if cached is None:
+            missing.append((start, end))
+        else:
+            weather[(start, end)] = cached
+
+    if missing:
+        fetched = fetch_analog_windows(latitude, longitude, missing)
+        for (start, end), window_weather in fetched.items():
+            if end < final_before:
+                cache.put(latitude, longitude, start, end, window_weather)
+        weather.update(fetched)
+
+    return [
+        {
+            "year": today.year - years_back,
+            "years_back": years_back,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "weather": weather[(start, end)],
+        }
+        for years_back, start, end in analog_windows(
+            years, days_before, days_after, today
+        )
+    ]
+
+
+def window_means(analog_year):
+    """
+    Returns {variable: mean} of an analog year, skipping empty windows
+    """
+    return {
+        variable: aggregates["mean"]
+        for variable, aggregates in analog_year["weather"].items()
+        if aggregates["mean"] is not None
+    }
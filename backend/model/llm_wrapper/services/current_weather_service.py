@@ -1,18 +1,31 @@
-import requests
 import json
-from datetime import datetime, timedelta
+from datetime import timedelta
 import os
 
-from model.llm_wrapper.services.meteoblue_model import MeteoblueQuery
+import model.llm_wrapper.services.http_client as http_client
+from model.llm_wrapper.services.grid import grid_cell, snap
+from model.llm_wrapper.services.nowcast_cache import get_nowcast_cache
 
 url_cehub = "https://services.cehub.syngenta-ais.com/api"
 url_meteoblue = "https://my.meteoblue.com/dataset/query?apikey"
 
 def get_current_weather(latitude, longitude):
-    current_time = datetime.now()
+    return get_cached_current_weather(latitude, longitude).value
+
+def get_cached_current_weather(latitude, longitude):
+    """
+    Returns CachedValue of the current weather, see nowcast_cache
+    """
+    return get_nowcast_cache().get(
+        ("current_weather", grid_cell(latitude, longitude, "NOWCAST")),
+        lambda bucket: fetch_current_weather(latitude, longitude, bucket),
+    )
+
+def fetch_current_weather(latitude, longitude, current_time):
+    latitude, longitude = snap(latitude, longitude, "NOWCAST")
     end_time = current_time + timedelta(minutes=120)
 
-    response = requests.get(
+    response = http_client.get(
         f"{url_cehub}/Forecast/Nowcast"
         f"?latitude={latitude}"
         f"&longitude={longitude}"
@@ -22,6 +35,7 @@ def get_current_weather(latitude, longitude):
         f"&supplier=Meteoblue",
         headers={"Accept": "application/json"},
     )
+    response.raise_for_status()
 
     parsed = json.loads(response.content)
 
@@ -44,255 +58,25 @@ def get_current_weather(latitude, longitude):
 
     return data
 
-def get_historical_weather_year_ago(latitude, longitude):
-    """
-    Retrieves weather data from one year ago for the given coordinates.
-    
-    Args:
-        latitude (float): Latitude coordinate
-        longitude (float): Longitude coordinate
-        
-    Returns:
-        dict: Weather data including temperature, humidity, etc.
-    """
-    current_time = datetime.now()
-    one_year_ago = current_time.replace(year=current_time.year - 1)
-    
-    # Set time range for one year ago (start and end dates)
-    start_time = one_year_ago - timedelta(days=3)
-    end_time = one_year_ago + timedelta(days=3)
-    
-    # Initialize data with coordinates
-    data = {"latitude": latitude, "longitude": longitude}
-    
-    # Get API key from environment variable
-    api_key = os.getenv('HISTORICAL_API_KEY')
-    if not api_key:
-        print("WARNING: Missing HISTORICAL_API_KEY environment variable")
-        return data
-    
-    try:
-        # Use the MeteoblueQuery class, similar to soil_service.py
-        query = MeteoblueQuery()
-        query.set_coordinates(latitude=latitude, longitude=longitude)
-        query.set_time_interval(start=start_time, end=end_time)
-        
-        # Add queries for temperature, humidity, wind, etc.
-        # Temperature
-        query.add_query(
-            domain="NEMSGLOBAL",
-            gap_fill_domain=None,
-            time_resolution="hourly",
-            code_dict={"code": 11, "level": "2 m above gnd"}
-        )
-        
-        # Relative Humidity
-        query.add_query(
-            domain="NEMSGLOBAL",
-            gap_fill_domain=None,
-            time_resolution="hourly",
-            code_dict={"code": 52, "level": "2 m above gnd"}
-        )
-        
-        # Wind Speed
-        query.add_query(
-            domain="NEMSGLOBAL",
-            gap_fill_domain=None,
-            time_resolution="hourly",
-            code_dict={"code": 32, "level": "10 m above gnd"}
-        )
-        
-        # Wind Direction
-        query.add_query(
-            domain="NEMSGLOBAL",
-            gap_fill_domain=None,
-            time_resolution="hourly",
-            code_dict={"code": 31, "level": "10 m above gnd"}
-        )
-        
-        # Precipitation
-        query.add_query(
-            domain="NEMSGLOBAL",
-            gap_fill_domain=None,
-            time_resolution="hourly",
-            code_dict={"code": 61, "level": "sfc"}
-        )
-        
-        response = requests.post(
-            url=f"https://my.meteoblue.com/dataset/query?apikey={api_key}",
-            json=query.body,
-            headers={"Content-Type": "application/json"},
-        )
-        
-        if response.status_code != 200:
-            print(f"API Error: Status code {response.status_code}")
-            print(f"Response: {response.text}")
-            return data
-        
-        # Parse the response
-        parsed_data = response.json()
-        
-        if isinstance(parsed_data, list) and len(parsed_data) >= 5:
-            try:
-                # Temperature (index 0)
-                if parsed_data[0]["codes"][0]["dataPerTimeInterval"][0]["data"]:
-                    data["temperature"] = parsed_data[0]["codes"][0]["dataPerTimeInterval"][0]["data"][0][0]
-                
-                # Humidity (index 1)
-                if parsed_data[1]["codes"][0]["dataPerTimeInterval"][0]["data"]:
-                    data["humidity"] = parsed_data[1]["codes"][0]["dataPerTimeInterval"][0]["data"][0][0]
-                
-                # Wind Speed (index 2)
-                if parsed_data[2]["codes"][0]["dataPerTimeInterval"][0]["data"]:
-                    data["wind_speed"] = parsed_data[2]["codes"][0]["dataPerTimeInterval"][0]["data"][0][0]
-                
-                # Wind Direction (index 3)
-                if parsed_data[3]["codes"][0]["dataPerTimeInterval"][0]["data"]:
-                    data["wind_direction"] = parsed_data[3]["codes"][0]["dataPerTimeInterval"][0]["data"][0][0]
-                
-                # Precipitation (index 4)
-                if parsed_data[4]["codes"][0]["dataPerTimeInterval"][0]["data"]:
-                    data["precipitation"] = parsed_data[4]["codes"][0]["dataPerTimeInterval"][0]["data"][0][0]
-            except (IndexError, KeyError) as e:
-                print(f"Error extracting data from response: {e}")
-                print(f"Response structure: {parsed_data[:100]}...")
-        
-    except requests.RequestException as e:
-        print(f"Request error: {e}")
-    except json.JSONDecodeError as e:
-        print(f"JSON parsing error: {e}")
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-    
-    return data
+def get_cloudiness(latitude, longitude):
+    return get_cached_cloudiness(latitude, longitude).value
 
 
-def get_historical_weather_two_year_ago(latitude, longitude):
+def get_cached_cloudiness(latitude, longitude):
     """
-    Retrieves weather data from one year ago for the given coordinates.
-    
-    Args:
-        latitude (float): Latitude coordinate
-        longitude (float): Longitude coordinate
-        
-    Returns:
-        dict: Weather data including temperature, humidity, etc.
+    Returns CachedValue of the cloudiness, see nowcast_cache
     """
-    current_time = datetime.now()
-    one_year_ago = current_time.replace(year=current_time.year - 2)
-    
-    # Set time range for one year ago (start and end dates)
-    start_time = one_year_ago - timedelta(days=3)
-    end_time = one_year_ago + timedelta(days=3)
-    
-    # Initialize data with coordinates
-    data = {"latitude": latitude, "longitude": longitude}
-    
-    # Get API key from environment variable
-    api_key = os.getenv('HISTORICAL_API_KEY')
-    if not api_key:
-        print("WARNING: Missing HISTORICAL_API_KEY environment variable")
-        return data
-    
-    try:
-        # Use the MeteoblueQuery class, similar to soil_service.py
-        query = MeteoblueQuery()
-        query.set_coordinates(latitude=latitude, longitude=longitude)
-        query.set_time_interval(start=start_time, end=end_time)
-        
-        # Add queries for temperature, humidity, wind, etc.
-        # Temperature
-        query.add_query(
-            domain="NEMSGLOBAL",
-            gap_fill_domain=None,
-            time_resolution="hourly",
-            code_dict={"code": 11, "level": "2 m above gnd"}
-        )
-        
-        # Relative Humidity
-        query.add_query(
-            domain="NEMSGLOBAL",
-            gap_fill_domain=None,
-            time_resolution="hourly",
-            code_dict={"code": 52, "level": "2 m above gnd"}
-        )
-        
-        # Wind Speed
-        query.add_query(
-            domain="NEMSGLOBAL",
-            gap_fill_domain=None,
-            time_resolution="hourly",
-            code_dict={"code": 32, "level": "10 m above gnd"}
-        )
-        
-        # Wind Direction
-        query.add_query(
-            domain="NEMSGLOBAL",
-            gap_fill_domain=None,
-            time_resolution="hourly",
-            code_dict={"code": 31, "level": "10 m above gnd"}
-        )
-        
-        # Precipitation
-        query.add_query(
-            domain="NEMSGLOBAL",
-            gap_fill_domain=None,
-            time_resolution="hourly",
-            code_dict={"code": 61, "level": "sfc"}
-        )
-        
-        response = requests.post(
-            url=f"https://my.meteoblue.com/dataset/query?apikey={api_key}",
-            json=query.body,
-            headers={"Content-Type": "application/json"},
-        )
-        
-        if response.status_code != 200:
-            print(f"API Error: Status code {response.status_code}")
-            print(f"Response: {response.text}")
-            return data
-        
-        # Parse the response
-        parsed_data = response.json()
-        
-        if isinstance(parsed_data, list) and len(parsed_data) >= 5:
-            try:
-                # Temperature (index 0)
-                if parsed_data[0]["codes"][0]["dataPerTimeInterval"][0]["data"]:
-                    data["temperature"] = parsed_data[0]["codes"][0]["dataPerTimeInterval"][0]["data"][0][0]
-                
-                # Humidity (index 1)
-                if parsed_data[1]["codes"][0]["dataPerTimeInterval"][0]["data"]:
-                    data["humidity"] = parsed_data[1]["codes"][0]["dataPerTimeInterval"][0]["data"][0][0]
-                
-                # Wind Speed (index 2)
-                if parsed_data[2]["codes"][0]["dataPerTimeInterval"][0]["data"]:
-                    data["wind_speed"] = parsed_data[2]["codes"][0]["dataPerTimeInterval"][0]["data"][0][0]
-                
-                # Wind Direction (index 3)
-                if parsed_data[3]["codes"][0]["dataPerTimeInterval"][0]["data"]:
-                    data["wind_direction"] = parsed_data[3]["codes"][0]["dataPerTimeInterval"][0]["data"][0][0]
-                
-                # Precipitation (index 4)
-                if parsed_data[4]["codes"][0]["dataPerTimeInterval"][0]["data"]:
-                    data["precipitation"] = parsed_data[4]["codes"][0]["dataPerTimeInterval"][0]["data"][0][0]
-            except (IndexError, KeyError) as e:
-                print(f"Error extracting data from response: {e}")
-                print(f"Response structure: {parsed_data[:100]}...")
-        
-    except requests.RequestException as e:
-        print(f"Request error: {e}")
-    except json.JSONDecodeError as e:
-        print(f"JSON parsing error: {e}")
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-    
-    return data
+    return get_nowcast_cache().get(
+        ("cloudiness", grid_cell(latitude, longitude, "NOWCAST")),
+        lambda bucket: fetch_cloudiness(latitude, longitude),
+    )
 
 
-def get_cloudiness(latitude, longitude):
+def fetch_cloudiness(latitude, longitude):
+    latitude, longitude = snap(latitude, longitude, "NOWCAST")
     url = f"https://my.meteoblue.com/packages/current?lat={latitude}&lon={longitude}&apikey=hTxj19ptoyqAH5YF"
-    response = requests.get(url)
+    response = http_client.get(url)
+    response.raise_for_status()
     parsed = response.json()
 
     match parsed["data_current"]["pictocode"]:  # sunny, cloudy, rainy, stormy
@@ -304,6 +88,3 @@ def get_cloudiness(latitude, longitude):
             return "rainy"
         case 16 | 14 | 12 | 14 | 16 | 6:
             return "stormy"
-
-
-get_cloudiness(47.25, 45.26)
@@ -0,0 +1,152 @@
+"""
+Registered fields, the work list of the prefetch scheduler
+
+Fields are stored in SQLite keyed by their NOWCAST grid cell (0.01 degrees)
+and crop. Requests for a registered cell update its last access time and
+access count, which order the prefetch. Accesses are counted in memory and
+written in one transaction by flush(), which the prefetch scheduler calls
+every FIELD_REGISTRY_FLUSH_SECONDS and before reading the work list, so
+requests never wait for SQLite.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from model.llm_wrapper.services.grid import grid_cell
+
+FIELD_DOMAIN = "NOWCAST"
+DEFAULT_PATH = Path(__file__).parent.parent / "data" / "field_registry.sqlite3"
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def field_cell(latitude, longitude):
+    _, row, column = grid_cell(latitude, longitude, FIELD_DOMAIN)
+    return row, column
+
+
+class FieldRegistry:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # Accesses are recorded on the request path, losing the last few on
+        # a crash is fine
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS field (
+                row INTEGER NOT NULL,
+                col INTEGER NOT NULL,
+                crop TEXT NOT NULL,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                last_access REAL NOT NULL,
+                access_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (row, col, crop)
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.commit()
+        self.lock = threading.Lock()
+        # {(row, col, crop or None): [last access, access count]}
+        self.accesses = {}
+        self.accesses_lock = threading.Lock()
+
+    def register(self, latitude, longitude, crop_type):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO field "
+                "(row, col, crop, latitude, longitude, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    *field_cell(latitude, longitude),
+                    crop_type,
+                    latitude,
+                    longitude,
+                    time.time(),
+                ),
+            )
+            self.connection.commit()
+
+    def unregister(self, latitude, longitude, crop_type):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM field WHERE row = ? AND col = ? AND crop = ?",
+                (*field_cell(latitude, longitude), crop_type),
+            )
+            self.connection.commit()
+
+    def touch(self, latitude, longitude, crop_type=None):
+        """
+        Records an access to the registered fields of the cell, of every crop
+        when crop_type is None, written by the next flush()
+        """
+        key = (*field_cell(latitude, longitude), crop_type)
+        with self.accesses_lock:
+            access = self.accesses.setdefault(key, [0.0, 0])
+            access[0] = time.time()
+            access[1] += 1
+
+    def flush(self):
+        """
+        Writes the buffered accesses, returns the number of cells written
+        """
+        with self.accesses_lock:
+            accesses, self.accesses = self.accesses, {}
+        if not accesses:
+            return 0
+        update = (
+            "UPDATE field SET last_access = max(last_access, ?), "
+            "access_count = access_count + ? WHERE row = ? AND col = ?"
+        )
+        with self.lock:
+            self.connection.executemany(
+                update,
+                [
+                    (last_access, count, row, column)
+                    for (row, column, crop), (last_access, count) in accesses.items()
+                    if crop is None
+                ],
+            )
+            self.connection.executemany(
+                update + " AND crop = ?",
+                [
+                    (last_access, count, row, column, crop)
+                    for (row, column, crop), (last_access, count) in accesses.items()
+                    if crop is not None
+                ],
+            )
+            self.connection.commit()
+        return len(accesses)
+
+    def by_priority(self):
+        """
+        Returns [(latitude, longitude, crop_type)], most recently accessed first
+        """
+        self.flush()
+        with self.lock:
+            return self.connection.execute(
+                "SELECT latitude, longitude, crop FROM field "
+                "ORDER BY last_access DESC, access_count DESC"
+            ).fetchall()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.connection.close()
+
+
+def get_field_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = FieldRegistry(
+                    os.getenv("FIELD_REGISTRY_PATH", str(DEFAULT_PATH))
+                )
+    return _registry
@@ -0,0 +1,93 @@
+"""
+Coordinate canonicalization
+
+Points are snapped to the nearest point of the native grid of the source
+domain, so nearby fields and GPS jitter resolve to the same cell and
+upstream returns the value of that grid point as is, without interpolating
+between neighbours. Cell (row, column) of a domain of step degrees is
+centered on the grid point (row * step, column * step). Caches and request
+deduplication key on grid_cell, upstream requests are sent for the grid
+point returned by snap.
+"""
+
+import math
+
+# Native resolution in degrees
+DOMAIN_RESOLUTIONS = {
+    "NEMSGLOBAL": 0.25,
+    "ERA5T": 0.25,
+    "SOILGRIDS1000": 1 / 120,
+    "SOILGRIDS": 1 / 120,
+    "SOILGRIDS2": 1 / 120,
+    # CEHub Nowcast and meteoblue packages/current
+    "NOWCAST": 0.01,
+}
+
+CENTER_PRECISION = 6
+
+
+def resolution(domain):
+    return DOMAIN_RESOLUTIONS[domain]
+
+
+def grid_index(coordinate, domain):
+    """
+    Returns the index of the grid line of the domain nearest to coordinate,
+    coordinates exactly between two lines take the upper one
+    """
+    # Rounding first keeps coordinates sitting exactly between lines stable
+    return math.floor(round(coordinate / resolution(domain), 9) + 0.5)
+
+
+def grid_cell(latitude, longitude, domain):
+    """
+    Returns hashable (domain, row, column) of the grid point nearest to
+    the point
+    """
+    return domain, grid_index(latitude, domain), grid_index(longitude, domain)
+
+
+def cell_center(cell):
+    domain, row, column = cell
+    step = resolution(domain)
+    return (
+        round(row * step, CENTER_PRECISION),
+        round(column * step, CENTER_PRECISION),
+    )
+
+
+def snap(latitude, longitude, domain):
+    """
+    Returns (latitude, longitude) of the nearest grid point of the domain
+    """
+    return cell_center(grid_cell(latitude, longitude, domain))
+
+
+def shared_point(latitude, longitude, domains):
+    """
+    Returns the grid point of the finest of domains sent for queries on all
+    of them. It is the grid point nearest to the point, moved by one step
+    toward the point when it lies exactly between two grid lines of a
+    coarser domain and would resolve to the other line than the point.
+    """
+    domain = finest_domain(domains)
+    step = resolution(domain)
+    snapped = list(snap(latitude, longitude, domain))
+    for axis, coordinate in enumerate((latitude, longitude)):
+        if any(
+            grid_index(snapped[axis], other) != grid_index(coordinate, other)
+            for other in domains
+        ):
+            snapped[axis] = round(
+                snapped[axis] + math.copysign(step, coordinate - snapped[axis]),
+                CENTER_PRECISION,
+            )
+    return tuple(snapped)
+
+
+def finest_domain(domains):
+    """
+    Returns the domain with the finest grid, used when one point is sent
+    for queries on several domains
+    """
+    return min(domains, key=resolution)
@@ -0,0 +1,210 @@
+"""
+Shared HTTP clients for the upstream services (Meteoblue, CEHub)
+
+Sync callers get one keep-alive requests.Session per host, async callers
+share one httpx.AsyncClient. Both are created at application startup and
+closed at shutdown; pool sizes come from the environment:
+
+    UPSTREAM_POOL_MAXSIZE       connections kept per host (default 20)
+    UPSTREAM_MAX_CONNECTIONS    connections of the async client (default 100)
+    UPSTREAM_KEEPALIVE_EXPIRY   seconds an idle connection is kept (default 30)
+    SINGLE_FLIGHT_WORKERS       threads running collapsed sync calls (default 32)
+
+Concurrent identical requests are collapsed into one upstream call, see
+single_flight. The remaining calls go through the per host timeouts, rate
+limit, concurrency limit, retries and circuit breaker of resilience. GETs
+and the Meteoblue dataset queries are retried, other POSTs are not.
+
+A collapsed call runs without deadline, every caller waits for it until its
+own deadline and gets UpstreamUnavailable when that passes first.
+"""
+
+import os
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from model.llm_wrapper.services.resilience import (
+    UpstreamUnavailable,
+    get_upstream,
+    no_deadline,
+    time_left,
+    upstream_stats,
+)
+from model.llm_wrapper.services.single_flight import (
+    AsyncSingleFlight,
+    SingleFlight,
+    request_key,
+)
+
+
+DEFAULT_HEADERS = {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+# (host, path) of POST endpoints that only read
+IDEMPOTENT_POSTS = {("my.meteoblue.com", "/dataset/query")}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_async_client = None
+_flights = SingleFlight(int(os.getenv("SINGLE_FLIGHT_WORKERS", 32)))
+_async_flights = AsyncSingleFlight()
+
+
+def pool_maxsize():
+    return int(os.getenv("UPSTREAM_POOL_MAXSIZE", 20))
+
+
+def max_connections():
+    return int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+
+
+def keepalive_expiry():
+    return float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", 30))
+
+
+def start():
+    """
+    Creates the async client, called at application startup
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            headers=DEFAULT_HEADERS,
+            limits=httpx.Limits(
+                max_connections=max_connections(),
+                max_keepalive_connections=pool_maxsize(),
+                keepalive_expiry=keepalive_expiry(),
+            ),
+        )
+    return _async_client
+
+
+async def close():
+    """
+    Closes every pooled connection, called at application shutdown
+    """
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get_async_client():
+    return _async_client or start()
+
+
+def get_session(url):
+    """
+    Returns the pooled session for the host of url
+    """
+    host = urlsplit(url).netloc
+    session = _sessions.get(host)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        if host not in _sessions:
+            session = requests.Session()
+            session.headers.update(DEFAULT_HEADERS)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize())
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+        return _sessions[host]
+
+
+def is_idempotent(method, url):
+    if method.upper() in ("GET", "HEAD"):
+        return True
+    parts = urlsplit(url)
+    return (parts.netloc, parts.path) in IDEMPOTENT_POSTS
+
+
+def deadline_exceeded(url):
+    return UpstreamUnavailable(f"{urlsplit(url).netloc}: deadline exceeded")
+
+
+def wait_time(url):
+    """
+    Returns the seconds a caller waits for its call, None without deadline
+    """
+    left = time_left()
+    if left is not None and left <= 0:
+        raise deadline_exceeded(url)
+    return left
+
+
+def request(method, url, **kwargs):
+    """
+    Sends a request with the pooled session of the host, the host timeouts
+    apply unless kwargs has a timeout. flight_key identifies the body for
+    the collapsing of identical requests, see request_key.
+    """
+    flight_key = kwargs.pop("flight_key", None)
+
+    def send(timeout):
+        return get_session(url).request(method, url, **{"timeout": timeout, **kwargs})
+
+    def flight():
+        with no_deadline():
+            return get_upstream(url).call(send, is_idempotent(method, url))
+
+    try:
+        return _flights.do(
+            request_key(method, url, kwargs, flight_key), flight, wait_time(url)
+        )
+    except TimeoutError:
+        raise deadline_exceeded(url)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+async def send_async(client, method, url, **kwargs):
+    """
+    Sends a request with an httpx.AsyncClient, collapsing concurrent
+    identical requests
+    """
+    flight_key = kwargs.pop("flight_key", None)
+
+    def send(timeout):
+        return client.request(method, url, **{"timeout": timeout, **kwargs})
+
+    async def flight():
+        # The task has its own copy of the context
+        with no_deadline():
+            return await get_upstream(url).call_async(send, is_idempotent(method, url))
+
+    try:
+        return await _async_flights.do(
+            request_key(method, url, kwargs, flight_key), flight, wait_time(url)
+        )
+    except TimeoutError:
+        raise deadline_exceeded(url)
+
+
+def single_flight_stats():
+    """
+    Returns counters of upstream calls and of calls collapsed into another
+    in-flight call
+    """
+    return {"sync": _flights.stats(), "async": _async_flights.stats()}
+
+
+def resilience_stats():
+    """
+    Returns the concurrency limit, circuit state and failure counters of
+    every upstream host
+    """
+    return upstream_stats()
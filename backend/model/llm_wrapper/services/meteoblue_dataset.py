@@ -0,0 +1,39 @@
+"""
+Client of the Meteoblue dataset API
+
+Sends a MeteoblueQuery through http_client, identical queries in flight
+share one request, and returns the DecodedResponse.
+"""
+
+import os
+
+import model.llm_wrapper.services.http_client as http_client
+from model.llm_wrapper.services.meteoblue_decoder import decode
+
+
+def dataset_url():
+    return f"https://my.meteoblue.com/dataset/query?apikey={os.getenv('HISTORICAL_API_KEY')}"
+
+
+def get_query(query):
+    response = http_client.post(
+        url=dataset_url(),
+        data=query.canonical,
+        headers={"Content-Type": "application/json"},
+        flight_key=query.key,
+    )
+    response.raise_for_status()
+    return decode(query, response.content)
+
+
+async def get_query_async(client, query):
+    response = await http_client.send_async(
+        client,
+        "POST",
+        url=dataset_url(),
+        data=query.canonical,
+        headers={"Content-Type": "application/json"},
+        flight_key=query.key,
+    )
+    response.raise_for_status()
+    return decode(query, response.content)
@@ -0,0 +1,118 @@
+"""
+Decoder of Meteoblue dataset responses
+
+The body is parsed with orjson when it is installed, the standard json
+module otherwise. Every series of the response becomes a float32 array of
+shape (points, steps) with NaN for gaps, with a datetime64[m] timestamp
+index. Series are addressed by their series key (see
+query_planner.series_key), located through the query that was sent, and
+only decoded when first read.
+"""
+
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from model.llm_wrapper.services.meteoblue_model import freeze_code
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Minutes per step, for responses without timestamps
+STEP_MINUTES = {"15min": 15, "hourly": 60, "3hourly": 180, "daily": 1440}
+
+# values (points, steps) float32, timestamps (steps,) datetime64[m]
+Series = namedtuple("Series", ["values", "timestamps"])
+
+
+def loads(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def parse_timestamp(timestamp):
+    """
+    Converts the compact form of the API, e.g. 20240101T0000
+    """
+    return (
+        f"{timestamp[:4]}-{timestamp[4:6]}-{timestamp[6:8]}"
+        f"T{timestamp[9:11] or '00'}:{timestamp[11:13] or '00'}"
+    )
+
+
+def derive_timestamps(time_interval, time_resolution, steps):
+    start = np.datetime64(time_interval[:10], "m")
+    minutes = STEP_MINUTES.get(time_resolution)
+    if minutes is None:
+        return np.full(steps, start if steps == 1 else np.datetime64("NaT", "m"))
+    return start + np.arange(steps) * np.timedelta64(minutes, "m")
+
+
+def to_float(value):
+    """
+    Returns a decoded value as float, None for gaps
+    """
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+class DecodedResponse:
+    def __init__(self, query, parsed):
+        self.query = query
+        self.parsed = parsed
+        self.decoded = {}
+
+    @property
+    def key(self):
+        return self.query.key
+
+    def __getitem__(self, key):
+        """
+        Returns the Series of a series key
+        """
+        series = self.decoded.get(key)
+        if series is None:
+            series = self.decoded[key] = self._decode(*key)
+        return series
+
+    def series(
+        self, domain, gap_fill_domain, time_resolution, code_dict, time_interval
+    ):
+        return self[
+            (
+                domain,
+                gap_fill_domain,
+                time_resolution,
+                freeze_code(code_dict),
+                time_interval,
+            )
+        ]
+
+    def _decode(self, domain, gap_fill_domain, time_resolution, code, time_interval):
+        query_index, code_index, interval_index = self.query.locate(
+            domain, gap_fill_domain, time_resolution, dict(code), time_interval
+        )
+        block = self.parsed[query_index]["codes"][code_index]
+        data = block["dataPerTimeInterval"][interval_index]["data"]
+        values = np.array(data, dtype=np.float32, ndmin=2)
+
+        timestamps = block.get("timeIntervals")
+        if timestamps and len(timestamps[interval_index]) == values.shape[1]:
+            index = np.array(
+                [parse_timestamp(t) for t in timestamps[interval_index]],
+                dtype="datetime64[m]",
+            )
+        else:
+            index = derive_timestamps(time_interval, time_resolution, values.shape[1])
+        return Series(values, index)
+
+
+def decode(query, content):
+    """
+    Returns the DecodedResponse of the body of a response to query
+    """
+    return DecodedResponse(query, loads(content))
@@ -1,55 +1,172 @@
-class MeteoblueQuery:
-    body = {
-        "units": {
-            "temperature": "C",
-            "velocity": "km/h",
-            "length": "metric",
-            "energy": "watts",
-        },
-        "geometry": {
-            "type": "MultiPoint",
-            "coordinates": [
-                [
-                    # 106.8,
-                    # 47.91
-                ]
+"""
+Meteoblue dataset API queries
+
+A MeteoblueQuery is an immutable value. Builder methods return a new query,
+so a query can be shared between threads, used as a dict key and reused as
+a template without leaking codes into other requests.
+
+Time intervals, query groups (domain, gap fill domain, time resolution) and
+the codes of a group are kept sorted and unique: two queries asking for the
+same data serialize to the same bytes whatever order they were built in.
+Points keep their order, the response is indexed by point. key is the
+sha256 of that serialization, stable across processes, and identifies the
+request in the upstream layers. Responses are addressed with locate instead
+of by the order codes were added.
+"""
+
+import hashlib
+import json
+from collections import namedtuple
+from functools import cached_property
+
+UNITS = {
+    "temperature": "C",
+    "velocity": "km/h",
+    "length": "metric",
+    "energy": "watts",
+}
+GEOMETRY_MODE = "preferLandWithMatchingElevation"
+
+
+def format_time_interval(start, end):
+    return f"{start.strftime('%Y-%m-%d')}T+00:00/{end.strftime('%Y-%m-%d')}T+00:00"
+
+
+def freeze_code(code_dict):
+    """
+    Returns a hashable, canonical form of a code dict
+    """
+    return tuple(sorted(code_dict.items()))
+
+
+def _code_order(code):
+    return json.dumps(code, default=str)
+
+
+def _group_order(group):
+    return tuple("" if value is None else value for value in group)
+
+
+def normalize_queries(queries):
+    """
+    Merges [((domain, gap_fill_domain, time_resolution), codes)] into a sorted
+    tuple of (group, sorted unique frozen codes)
+    """
+    groups = {}
+    for group, codes in queries:
+        merged = groups.setdefault(tuple(group), set())
+        merged.update(
+            code if isinstance(code, tuple) else freeze_code(code) for code in codes
+        )
+    return tuple(
+        (group, tuple(sorted(groups[group], key=_code_order)))
+        for group in sorted(groups, key=_group_order)
+    )
+
+
+class MeteoblueQuery(
+    namedtuple("MeteoblueQuery", ["points", "time_intervals", "queries"])
+):
+    """
+    points          ((latitude, longitude), ...)
+    time_intervals  sorted formatted intervals
+    queries         ((domain, gap_fill_domain, time_resolution), codes), ...)
+    """
+
+    def __new__(cls, points=(), time_intervals=(), queries=()):
+        return super().__new__(
+            cls,
+            tuple(
+                (float(latitude), float(longitude)) for latitude, longitude in points
+            ),
+            tuple(sorted(set(time_intervals))),
+            normalize_queries(queries),
+        )
+
+    def with_coordinates(self, latitude, longitude):
+        return self.with_points([(latitude, longitude)])
+
+    def with_points(self, points):
+        """
+        Returns the query with the MultiPoint geometry [(latitude, longitude), ...]
+        """
+        return MeteoblueQuery(points, self.time_intervals, self.queries)
+
+    def with_time_interval(self, start, end):
+        return self.with_time_intervals([format_time_interval(start, end)])
+
+    def with_time_intervals(self, time_intervals):
+        return MeteoblueQuery(self.points, time_intervals, self.queries)
+
+    def with_codes(self, domain, gap_fill_domain, time_resolution, codes):
+        """
+        Returns the query with codes added to the group of domain, gap fill
+        domain and time resolution
+        """
+        return MeteoblueQuery(
+            self.points,
+            self.time_intervals,
+            self.queries + (((domain, gap_fill_domain, time_resolution), codes),),
+        )
+
+    def merge(self, other):
+        """
+        Returns one query for the codes of both, which must share the
+        geometry and time intervals
+        """
+        if (self.points, self.time_intervals) != (other.points, other.time_intervals):
+            raise ValueError(
+                "Only queries of the same geometry and time intervals merge"
+            )
+        return MeteoblueQuery(
+            self.points, self.time_intervals, self.queries + other.queries
+        )
+
+    def locate(
+        self, domain, gap_fill_domain, time_resolution, code_dict, time_interval
+    ):
+        """
+        Returns (query_index, code_index, interval_index) of a series in the
+        response
+        """
+        groups = [group for group, _ in self.queries]
+        query_index = groups.index((domain, gap_fill_domain, time_resolution))
+        code_index = self.queries[query_index][1].index(freeze_code(code_dict))
+        return query_index, code_index, self.time_intervals.index(time_interval)
+
+    @property
+    def body(self):
+        return {
+            "units": dict(UNITS),
+            "geometry": {
+                "type": "MultiPoint",
+                "coordinates": [
+                    [longitude, latitude] for latitude, longitude in self.points
+                ],
+                "locationNames": [""] * len(self.points),
+                "mode": GEOMETRY_MODE,
+            },
+            "format": "json",
+            "timeIntervals": list(self.time_intervals),
+            "timeIntervalsAlignment": "none",
+            "queries": [
+                {
+                    "domain": domain,
+                    "gapFillDomain": gap_fill_domain,
+                    "timeResolution": time_resolution,
+                    "codes": [dict(code) for code in codes],
+                }
+                for (domain, gap_fill_domain, time_resolution), codes in self.queries
             ],
-            "locationNames": [""],
-            "mode": "preferLandWithMatchingElevation",
-        },
-        "format": "json",
-        "timeIntervals": [
-            # "2024-01-01T+00:00/2024-01-02T+00:00"
-        ],
-        "timeIntervalsAlignment": "none",
-        "queries": [
-            # {
-            #     "domain": "NEMSGLOBAL",
-            #     "gapFillDomain": None,
-            #     "timeResolution": "daily",
-            #     "codes": [
-            #         {
-            #             "code": 11,
-            #             "level": "2 m above gnd",
-            #             "aggregation": "max"
-            #         }
-            #     ],
-            # }
-        ],
-    }
-
-    def set_coordinates(self, latitude, longitude):
-        self.body["geometry"]["coordinates"][0] = ([longitude, latitude])
-
-    def set_time_interval(self, start, end):
-        self.body["timeIntervals"] = [f"{start.strftime("%Y-%m-%d")}T+00:00/{end.strftime("%Y-%m-%d")}T+00:00"]
-
-    def add_query(self, domain, gap_fill_domain,time_resolution, code_dict):
-        self.body["queries"].append({
-            "domain": domain,
-            "gapFillDomain": gap_fill_domain,
-            "timeResolution": time_resolution,
-            "codes": [
-                code_dict
-            ]
-        })
+        }
+
+    @cached_property
+    def canonical(self):
+        """
+        The request body as compact JSON bytes with sorted keys
+        """
+        return json.dumps(self.body, sort_keys=True, separators=(",", ":")).encode()
+
+    @cached_property
+    def key(self):
+        return hashlib.sha256(self.canonical).hexdigest()
@@ -0,0 +1,154 @@
+"""
+Stale-while-revalidate cache for the 15 minute nowcast products
+
+Values are cached per NOWCAST grid cell and 15 minute bucket, the cadence
+of the CEHub nowcast (Temperature_15Min, ...) and of packages/current. A
+value of the current bucket is returned as is. A value of an older bucket is
+returned immediately while a background thread fetches the current one.
+When that refresh fails the old value keeps being served, marked stale,
+with its age. Only cold cells and values older than
+NOWCAST_MAX_STALE_MINUTES wait for upstream.
+
+    NOWCAST_CACHE_SIZE          cells x products kept (default 10000)
+    NOWCAST_MAX_STALE_MINUTES   oldest value served without waiting (default 180)
+    NOWCAST_REFRESH_WORKERS     background refresh threads (default 4)
+"""
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BUCKET_MINUTES = 15
+
+# age_seconds is the time since the value was fetched, stale is set when
+# the latest refresh of it failed
+CachedValue = namedtuple("CachedValue", ["value", "age_seconds", "stale"])
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def bucket_start(moment):
+    return moment.replace(
+        minute=moment.minute - moment.minute % BUCKET_MINUTES,
+        second=0,
+        microsecond=0,
+    )
+
+
+class Entry:
+    def __init__(self, value, bucket, fetched_at):
+        self.value = value
+        self.bucket = bucket
+        self.fetched_at = fetched_at
+        self.failed = False
+
+    def cached(self, now):
+        age = max(0, int((now - self.fetched_at).total_seconds()))
+        return CachedValue(self.value, age, self.failed)
+
+
+class NowcastCache:
+    def __init__(self, max_entries, max_stale, workers):
+        self.max_entries = max_entries
+        self.max_stale = max_stale
+        self.entries = OrderedDict()
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="nowcast")
+
+    def get(self, key, fetch, now=None):
+        """
+        Returns CachedValue of key, fetch(bucket_start) loads a fresh value
+        """
+        now = now or datetime.now()
+        bucket = bucket_start(now)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        if entry is None:
+            return self._fetch(key, fetch, bucket, now).cached(now)
+        if entry.bucket == bucket:
+            return entry.cached(now)
+        if now - entry.fetched_at > self.max_stale:
+            try:
+                return self._fetch(key, fetch, bucket, now).cached(now)
+            except Exception as e:
+                print(f"Error refreshing {key}, serving cached value: {e}")
+                entry.failed = True
+                return entry.cached(now)
+
+        self._refresh_in_background(key, fetch, bucket)
+        return entry.cached(now)
+
+    def _fetch(self, key, fetch, bucket, now):
+        entry = Entry(fetch(bucket), bucket, now)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def _refresh_in_background(self, key, fetch, bucket):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        try:
+            self.executor.submit(self._refresh, key, fetch, bucket)
+        except RuntimeError:
+            # Closed, the cached value is served without a refresh
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def _refresh(self, key, fetch, bucket):
+        try:
+            self._fetch(key, fetch, bucket, datetime.now())
+        except Exception as e:
+            print(f"Error refreshing {key}, serving cached value: {e}")
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry is not None:
+                entry.failed = True
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def close(self):
+        """
+        Stops the refresh threads without waiting for running refreshes,
+        queued ones are dropped
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_nowcast_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = NowcastCache(
+                    int(os.getenv("NOWCAST_CACHE_SIZE", 10000)),
+                    timedelta(
+                        minutes=float(os.getenv("NOWCAST_MAX_STALE_MINUTES", 180))
+                    ),
+                    int(os.getenv("NOWCAST_REFRESH_WORKERS", 4)),
+                )
+    return _cache
+
+
+def close_nowcast_cache():
+    """
+    Closes the cache when one was created, the next get_nowcast_cache()
+    starts a new one
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+            _cache = None
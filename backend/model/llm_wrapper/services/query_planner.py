@@ -0,0 +1,96 @@
+from model.llm_wrapper.services.meteoblue_model import (
+    MeteoblueQuery,
+    format_time_interval,
+)
+from model.llm_wrapper.services.grid import DOMAIN_RESOLUTIONS, shared_point
+
+
+def series_key(domain, gap_fill_domain, time_resolution, code_dict, time_interval):
+    """
+    Returns a hashable key identifying one series of a dataset query
+    """
+    return (
+        domain,
+        gap_fill_domain,
+        time_resolution,
+        tuple(sorted(code_dict.items())),
+        time_interval,
+    )
+
+
+class QueryPlanner:
+    """
+    Collects every series a set of calculations needs for one location and
+    fetches them with a single Meteoblue dataset request.
+
+    Codes sharing a domain, gap fill domain and time resolution are sent as
+    one query, distinct time windows become separate time intervals. The
+    point is snapped to the finest grid among the planned domains.
+
+    A planner created with for_points sends all points as one MultiPoint
+    geometry, slice then selects the data of one point.
+    """
+
+    def __init__(self, latitude, longitude):
+        self.points = [(latitude, longitude)]
+        self.time_intervals = []
+        self.queries = {}
+        self.series = {}
+
+    @classmethod
+    def for_points(cls, points):
+        """
+        Returns a planner for [(latitude, longitude), ...]
+        """
+        planner = cls(*points[0])
+        planner.points = list(points)
+        return planner
+
+    def add(self, domain, gap_fill_domain, time_resolution, code_dict, start, end):
+        """
+        Registers a series and returns the key its data is sliced under
+        """
+        time_interval = format_time_interval(start, end)
+        key = series_key(
+            domain, gap_fill_domain, time_resolution, code_dict, time_interval
+        )
+        if key in self.series:
+            return key
+
+        if time_interval not in self.time_intervals:
+            self.time_intervals.append(time_interval)
+        codes = self.queries.setdefault((domain, gap_fill_domain, time_resolution), [])
+        if code_dict not in codes:
+            codes.append(code_dict)
+        self.series[key] = ((domain, gap_fill_domain, time_resolution), code_dict)
+        return key
+
+    def coordinates(self):
+        domains = [
+            domain for domain, _, _ in self.queries if domain in DOMAIN_RESOLUTIONS
+        ]
+        if not domains:
+            return list(self.points)
+        return [
+            shared_point(latitude, longitude, domains)
+            for latitude, longitude in self.points
+        ]
+
+    def build(self):
+        return MeteoblueQuery(
+            self.coordinates(),
+            self.time_intervals,
+            [(group, codes) for group, codes in self.queries.items()],
+        )
+
+    def slice(self, response, point=0):
+        """
+        Splits a DecodedResponse into {key: float32 array} for the given point
+        """
+        return {key: response[key].values[point] for key in self.series}
+
+    def execute(self, get_query):
+        """
+        Sends the planned request through get_query and returns the sliced data
+        """
+        return self.slice(get_query(self.build()))
@@ -0,0 +1,467 @@
+"""
+Resilience layer for the upstream services
+
+Every upstream host gets
+
+    timeouts               (connect, read) seconds from HOST_TIMEOUTS,
+                           DEFAULT_TIMEOUT for other hosts
+    a token bucket         UPSTREAM_RATE_LIMIT requests per second, bursts of
+                           UPSTREAM_BURST (defaults 20 and 40)
+    a concurrency limit    AIMD: grows by one per round trip while latency
+                           stays below LATENCY_FACTOR times the baseline
+                           latency, halves on failures and slow responses,
+                           between 1 and UPSTREAM_MAX_CONCURRENCY (default 32)
+    a circuit breaker      opens after UPSTREAM_BREAKER_FAILURES consecutive
+                           failures (default 5), fails fast for
+                           UPSTREAM_BREAKER_COOLDOWN seconds (default 30),
+                           then lets one trial call through
+
+Idempotent calls are retried up to UPSTREAM_RETRIES times (default 2) on
+connection errors, timeouts, 429 and 5xx, with full jitter exponential
+backoff. Waiting for a token or a concurrency slot is bounded by the read
+timeout, callers get UpstreamUnavailable instead of queueing indefinitely.
+
+A deadline set with deadline_after bounds every upstream call made in its
+context, including tasks created there: timeouts are shortened to the time
+left, retries stop when the backoff would overrun it, and calls after it
+fail immediately. Calls cut short by a deadline do not count as upstream
+failures.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+
+# (connect, read) seconds
+HOST_TIMEOUTS = {
+    "my.meteoblue.com": (3.05, 20),
+    "services.cehub.syngenta-ais.com": (3.05, 10),
+}
+DEFAULT_TIMEOUT = (3.05, 15)
+
+LATENCY_FACTOR = 3
+INITIAL_CONCURRENCY = 8
+BACKOFF_BASE = 0.2
+BACKOFF_CAP = 2.0
+
+_deadline = ContextVar("upstream_deadline", default=None)
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+class UpstreamUnavailable(requests.exceptions.ConnectionError):
+    """
+    Raised without calling upstream, when the circuit is open or no token or
+    concurrency slot frees up in time
+    """
+
+
+def rate_limit():
+    return float(os.getenv("UPSTREAM_RATE_LIMIT", 20))
+
+
+def burst():
+    return float(os.getenv("UPSTREAM_BURST", 40))
+
+
+def max_concurrency():
+    return int(os.getenv("UPSTREAM_MAX_CONCURRENCY", 32))
+
+
+def retries():
+    return int(os.getenv("UPSTREAM_RETRIES", 2))
+
+
+def breaker_failures():
+    return int(os.getenv("UPSTREAM_BREAKER_FAILURES", 5))
+
+
+def breaker_cooldown():
+    return float(os.getenv("UPSTREAM_BREAKER_COOLDOWN", 30))
+
+
+@contextmanager
+def deadline_after(seconds):
+    """
+    Bounds the upstream calls made in the block to seconds from now, no
+    bound when seconds is None
+    """
+    deadline = None if seconds is None else time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None and (deadline is None or current < deadline):
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def no_deadline():
+    """
+    Lifts the deadline in the block, for calls shared by callers with
+    different deadlines
+    """
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_left():
+    """
+    Returns the seconds left before the deadline, None without deadline
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def is_failure(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """
+        Takes a token, returns the seconds to wait before using it or None
+        when that would be longer than max_wait
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self.tokens -= 1
+            return wait
+
+    def refund(self):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class AdaptiveLimit:
+    """
+    AIMD concurrency limit driven by the latency of completed calls
+    """
+
+    def __init__(self, initial, maximum):
+        self.limit = float(min(initial, maximum))
+        self.maximum = maximum
+        self.in_flight = 0
+        self.baseline = None
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+        # [(loop, future)] of the coroutines waiting for a slot, the limit
+        # is shared with threads so they are woken from release
+        self.async_waiters = []
+
+    def acquire(self, timeout):
+        with self.condition:
+            if not self.condition.wait_for(
+                lambda: self.in_flight < int(self.limit), timeout
+            ):
+                return False
+            self.in_flight += 1
+            return True
+
+    async def acquire_async(self, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self.condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return True
+                waiter = (loop, loop.create_future())
+                self.async_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter[1], deadline - loop.time())
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                with self.condition:
+                    if waiter in self.async_waiters:
+                        self.async_waiters.remove(waiter)
+
+    def release(self, latency=None, failed=False):
+        """
+        Frees the slot, adjusts the limit unless latency is None (the call
+        was abandoned)
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+            for loop, future in self.async_waiters:
+                loop.call_soon_threadsafe(wake, future)
+            self.async_waiters.clear()
+            if latency is None:
+                return
+            if not failed:
+                # Follows drops immediately, rises slowly
+                self.baseline = (
+                    latency
+                    if self.baseline is None
+                    else min(latency, self.baseline + (latency - self.baseline) / 100)
+                )
+            slow = (
+                self.baseline is not None and latency > LATENCY_FACTOR * self.baseline
+            )
+            now = time.monotonic()
+            if failed or slow:
+                # At most one decrease per round trip
+                if now - self.last_decrease > latency:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+
+def wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures, cooldown):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self.trial_in_flight:
+                    return False
+                self.trial_in_flight = True
+            return True
+
+    def cancel(self):
+        """
+        Gives back an admission that did not reach upstream
+        """
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record(self, failed):
+        with self.lock:
+            self.trial_in_flight = False
+            if not failed:
+                self.state = self.CLOSED
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            if (
+                self.state == self.HALF_OPEN
+                or self.consecutive_failures >= self.failures
+            ):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class Upstream:
+    def __init__(self, host):
+        self.host = host
+        self.timeout = HOST_TIMEOUTS.get(host, DEFAULT_TIMEOUT)
+        self.bucket = TokenBucket(rate_limit(), burst())
+        self.limit = AdaptiveLimit(INITIAL_CONCURRENCY, max_concurrency())
+        self.breaker = CircuitBreaker(breaker_failures(), breaker_cooldown())
+        self.failures = 0
+        self.rejected = 0
+
+    def call(self, send, idempotent):
+        """
+        Calls send(timeout) -> requests.Response
+        """
+        attempts = 1 + (retries() if idempotent else 0)
+        for attempt in range(attempts):
+            time.sleep(self._admit())
+            if not self.limit.acquire(self._bounded()[1]):
+                self.bucket.refund()
+                self.breaker.cancel()
+                self._reject("no concurrency slot")
+            connect, read, cut = self._start()
+            response, error = None, None
+            started = time.monotonic()
+            try:
+                response = send((connect, read))
+            except requests.Timeout as e:
+                if cut:
+                    self._abandon()
+                    raise
+                error = e
+            except requests.RequestException as e:
+                error = e
+            except BaseException:
+                self._abandon()
+                raise
+            if self._complete(response, time.monotonic() - started):
+                return response
+            delay = backoff(attempt)
+            if attempt + 1 == attempts or not self._can_wait(delay):
+                return self._result(response, error)
+            time.sleep(delay)
+
+    async def call_async(self, send, idempotent):
+        """
+        Calls await send(timeout) -> httpx.Response
+        """
+        attempts = 1 + (retries() if idempotent else 0)
+        for attempt in range(attempts):
+            wait = self._admit()
+            # Admitted, the breaker and bucket get their admission back
+            # unless a slot is taken
+            try:
+                await asyncio.sleep(wait)
+                acquired = await self.limit.acquire_async(self._bounded()[1])
+            except BaseException:
+                self.bucket.refund()
+                self.breaker.cancel()
+                raise
+            if not acquired:
+                self.bucket.refund()
+                self.breaker.cancel()
+                self._reject("no concurrency slot")
+            connect, read, cut = self._start()
+            response, error = None, None
+            started = time.monotonic()
+            try:
+                response = await send(httpx.Timeout(read, connect=connect))
+            except httpx.TimeoutException as e:
+                if cut:
+                    self._abandon()
+                    raise
+                error = e
+            except httpx.HTTPError as e:
+                error = e
+            except BaseException:
+                # Cancelled, e.g. by the deadline of the caller
+                self._abandon()
+                raise
+            if self._complete(response, time.monotonic() - started):
+                return response
+            delay = backoff(attempt)
+            if attempt + 1 == attempts or not self._can_wait(delay):
+                return self._result(response, error)
+            await asyncio.sleep(delay)
+
+    def _bounded(self):
+        """
+        Returns (connect, read, cut), the host timeouts shortened to the
+        deadline and whether they were
+        """
+        connect, read = self.timeout
+        left = time_left()
+        if left is None or left >= read:
+            return connect, read, False
+        return max(0.0, min(connect, left)), max(0.0, left), True
+
+    def _start(self):
+        """
+        Returns the timeouts of a call holding a concurrency slot
+        """
+        connect, read, cut = self._bounded()
+        if read <= 0:
+            self._abandon()
+            self._reject("deadline exceeded")
+        return connect, read, cut
+
+    def _can_wait(self, delay):
+        left = time_left()
+        return left is None or left > delay
+
+    def _admit(self):
+        """
+        Returns the seconds to wait for the rate limit
+        """
+        max_wait = self._bounded()[1]
+        if max_wait <= 0:
+            self._reject("deadline exceeded")
+        wait = self.bucket.reserve(max_wait)
+        if wait is None:
+            self._reject("rate limited")
+        if not self.breaker.allow():
+            self.bucket.refund()
+            self._reject("circuit open")
+        return wait
+
+    def _reject(self, reason):
+        self.rejected += 1
+        raise UpstreamUnavailable(f"{self.host}: {reason}")
+
+    def _complete(self, response, latency):
+        """
+        Records the outcome of a call, returns whether it succeeded
+        """
+        failed = response is None or is_failure(response.status_code)
+        self.limit.release(latency, failed)
+        self.breaker.record(failed)
+        if failed:
+            self.failures += 1
+        return not failed
+
+    def _abandon(self):
+        self.limit.release()
+        self.breaker.cancel()
+
+    def _result(self, response, error):
+        if response is None:
+            raise error
+        return response
+
+    def stats(self):
+        return {
+            "concurrency_limit": int(self.limit.limit),
+            "in_flight": self.limit.in_flight,
+            "baseline_latency": self.limit.baseline,
+            "circuit": self.breaker.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+
+def get_upstream(url):
+    host = urlsplit(url).netloc
+    upstream = _upstreams.get(host)
+    if upstream is None:
+        with _upstreams_lock:
+            upstream = _upstreams.setdefault(host, Upstream(host))
+    return upstream
+
+
+def upstream_stats():
+    return {host: upstream.stats() for host, upstream in list(_upstreams.items())}
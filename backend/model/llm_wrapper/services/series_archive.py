@@ -0,0 +1,202 @@
+"""
+Local archive of daily series per grid cell and variable
+
+Every (cell, series) pair is one .npy file of shape (4, days) indexed by
+days since EPOCH:
+
+    VALUES        daily value, NaN for gaps
+    FINAL         1 for days that will not change upstream anymore, minus
+                  the fetch time (POSIX seconds) for days that still can,
+                  0 for days never fetched
+    PREFIX_SUM    running sum of the values up to and including the day
+    PREFIX_COUNT  running count of non-missing values
+
+Days with a value older than the final lag of their domain (FINAL_LAG_DAYS,
+longer for reanalysis domains that are published with a delay) never
+change upstream, so a rolling window only needs the missing or not yet
+final days fetched. Gaps are never final. Not yet final days count as
+fetched for SERIES_ARCHIVE_TTL_MINUTES (default 180), which lets a prefetch
+ahead of the morning peak cover the requests of the peak. Window sums,
+means and missing counts are two lookups in the prefix rows of the
+memory-mapped file, whatever the window length.
+"""
+
+import math
+import os
+import threading
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from model.llm_wrapper.services.grid import DOMAIN_RESOLUTIONS, grid_cell
+
+EPOCH = date(2010, 1, 1)
+FINAL_LAG_DAYS = 2
+# ERA5T is published about 5 days behind real time
+DOMAIN_FINAL_LAG_DAYS = {"ERA5T": 6}
+VALUES, FINAL, PREFIX_SUM, PREFIX_COUNT = range(4)
+ROWS = 4
+DEFAULT_DIRECTORY = Path(__file__).parent.parent / "data" / "series_archive"
+DEFAULT_TTL_MINUTES = 180
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def is_archived(series, start):
+    return (
+        series["time_resolution"] == "daily"
+        and series["domain"] in DOMAIN_RESOLUTIONS
+        and as_date(start) >= EPOCH
+    )
+
+
+def final_lag_days(domain):
+    return DOMAIN_FINAL_LAG_DAYS.get(domain, FINAL_LAG_DAYS)
+
+
+def prefix_rows(values):
+    """
+    Returns (PREFIX_SUM, PREFIX_COUNT) rows of a values row
+    """
+    present = ~np.isnan(values)
+    return np.cumsum(np.where(present, values, 0.0)), np.cumsum(present)
+
+
+def day_index(day):
+    return (day - EPOCH).days
+
+
+def as_date(moment):
+    return moment.date() if hasattr(moment, "date") else moment
+
+
+class SeriesArchive:
+    def __init__(self, directory, ttl=None):
+        self.directory = Path(directory)
+        self.ttl = timedelta(minutes=DEFAULT_TTL_MINUTES) if ttl is None else ttl
+        self.lock = threading.Lock()
+
+    def path(self, latitude, longitude, series):
+        domain, row, column = grid_cell(latitude, longitude, series["domain"])
+        code = "_".join(
+            f"{name}-{value}" for name, value in sorted(series["code_dict"].items())
+        ).replace(" ", "")
+        return self.directory / f"{domain}_{row}_{column}" / f"{code}.npy"
+
+    def load(self, path):
+        if path.exists():
+            return np.load(path, mmap_mode="r")
+        return np.empty((ROWS, 0), dtype=np.float64)
+
+    def save(self, path, archived):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(".tmp.npy")
+        np.save(temporary, archived)
+        os.replace(temporary, path)
+
+    def plan(self, latitude, longitude, series, start, end):
+        """
+        Returns the (start, end) dates still to fetch for the window, or None
+        when the archive covers it
+        """
+        start, end = as_date(start), as_date(end)
+        archived = self.load(self.path(latitude, longitude, series))
+        first, last = day_index(start), day_index(end)
+        covered = np.zeros(last - first + 1, dtype=bool)
+        state = archived[FINAL, first : last + 1]
+        recent = -state >= time.time() - self.ttl.total_seconds()
+        covered[: len(state)] = (state > 0) | ((state < 0) & recent)
+        if covered.all():
+            return None
+        return start + timedelta(days=int(np.argmin(covered))), end
+
+    def store(self, latitude, longitude, series, start, data):
+        """
+        Writes daily data beginning at start into the archive
+        """
+        start = as_date(start)
+        if not len(data):
+            return
+
+        path = self.path(latitude, longitude, series)
+        first = day_index(start)
+        last = first + len(data)
+        final_after = day_index(date.today()) - final_lag_days(series["domain"])
+        with self.lock:
+            archived = self.load(path)
+            length = max(last, archived.shape[1])
+            updated = np.zeros((ROWS, length), dtype=np.float64)
+            updated[VALUES] = np.nan
+            updated[:, : archived.shape[1]] = archived
+            updated[VALUES, first:last] = data
+            updated[FINAL, first:last] = np.where(
+                (np.arange(first, last) <= final_after) & ~np.isnan(data),
+                1.0,
+                -time.time(),
+            )
+
+            # Only the prefix rows from the first written day onward change,
+            # days between the old end of the archive and first are gaps
+            changed_from = min(first, archived.shape[1])
+            base_sum = updated[PREFIX_SUM, changed_from - 1] if changed_from else 0.0
+            base_count = (
+                updated[PREFIX_COUNT, changed_from - 1] if changed_from else 0.0
+            )
+            sums, counts = prefix_rows(updated[VALUES, changed_from:])
+            updated[PREFIX_SUM, changed_from:] = base_sum + sums
+            updated[PREFIX_COUNT, changed_from:] = base_count + counts
+            self.save(path, updated)
+
+    def read(self, latitude, longitude, series, start, end):
+        """
+        Returns the values of start..end as float32 array, NaN for gaps
+        """
+        first, last = day_index(as_date(start)), day_index(as_date(end))
+        window = np.full(last - first + 1, np.nan, dtype=np.float32)
+        archived = self.load(self.path(latitude, longitude, series))
+        values = archived[VALUES, first : last + 1]
+        window[: len(values)] = values
+        return window
+
+    def window_stats(self, latitude, longitude, series, start, end):
+        """
+        Returns (sum, count, missing) of start..end in constant time
+        """
+        first, last = day_index(as_date(start)), day_index(as_date(end))
+        archived = self.load(self.path(latitude, longitude, series))
+        days = last - first + 1
+        if archived.shape[1] == 0 or first >= archived.shape[1]:
+            return 0.0, 0, days
+        last = min(last, archived.shape[1] - 1)
+        total = archived[PREFIX_SUM, last]
+        count = archived[PREFIX_COUNT, last]
+        if first > 0:
+            total -= archived[PREFIX_SUM, first - 1]
+            count -= archived[PREFIX_COUNT, first - 1]
+        return float(total), int(count), days - int(count)
+
+    def window_sum(self, latitude, longitude, series, start, end):
+        return self.window_stats(latitude, longitude, series, start, end)[0]
+
+    def window_mean(self, latitude, longitude, series, start, end):
+        total, count, _ = self.window_stats(latitude, longitude, series, start, end)
+        return total / count if count else math.nan
+
+
+def get_series_archive():
+    global _archive
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = SeriesArchive(
+                    os.getenv("SERIES_ARCHIVE_DIR", str(DEFAULT_DIRECTORY)),
+                    timedelta(
+                        minutes=float(
+                            os.getenv("SERIES_ARCHIVE_TTL_MINUTES", DEFAULT_TTL_MINUTES)
+                        )
+                    ),
+                )
+    return _archive
@@ -0,0 +1,131 @@
+"""
+Collapsing of concurrent identical upstream requests
+
+While a request is in flight, callers with the same key wait for its result
+instead of sending their own. Nothing is kept once the request completes,
+so this only merges overlapping calls, e.g. the burst of identical
+/getRiskStats requests after a weather alert.
+
+The shared call serves callers with different budgets, so it should not be
+bound by the deadline of the caller that started it. Every caller instead
+waits for it at most its own timeout and gets TimeoutError when that runs
+out, the call goes on for the others.
+"""
+
+import asyncio
+import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+
+def canonical_body(body):
+    if body is None or isinstance(body, (str, bytes)):
+        return body
+    return json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def request_key(method, url, kwargs, body_key=None):
+    """
+    Returns a hashable key of the request, independent of the order of query
+    parameters and JSON object keys. body_key, e.g. MeteoblueQuery.key,
+    stands for the body when given.
+    """
+    parts = urlsplit(url)
+    params = parse_qsl(parts.query) + list((kwargs.get("params") or {}).items())
+    if body_key is None:
+        body = (canonical_body(kwargs.get("json")), canonical_body(kwargs.get("data")))
+    else:
+        body = (body_key,)
+    return (
+        method.upper(),
+        parts.netloc,
+        parts.path,
+        tuple(sorted((str(name), str(value)) for name, value in params)),
+        *body,
+    )
+
+
+class SingleFlight:
+    """
+    Thread based, for the sync requests sessions
+
+    The caller that starts the call runs it itself when it has no timeout,
+    in a pool of max_workers threads otherwise so that it can stop waiting.
+    """
+
+    def __init__(self, max_workers=32):
+        self.executor = ThreadPoolExecutor(max_workers, "single-flight")
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.calls = 0
+        self.collapsed = 0
+
+    def do(self, key, call, timeout=None):
+        with self.lock:
+            self.calls += 1
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+            else:
+                self.collapsed += 1
+
+        if leader and timeout is None:
+            self._run(key, call, future)
+        elif leader:
+            self.executor.submit(self._run, key, call, future)
+        return future.result(timeout)
+
+    def _run(self, key, call, future):
+        try:
+            result = call()
+        except BaseException as e:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            return
+        with self.lock:
+            del self.in_flight[key]
+        future.set_result(result)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "collapsed": self.collapsed,
+                "in_flight": len(self.in_flight),
+            }
+
+
+class AsyncSingleFlight:
+    """
+    asyncio based, for the shared httpx client
+
+    The request runs in its own task, so a caller being cancelled or timing
+    out does not cancel the request the other callers are waiting for.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.calls = 0
+        self.collapsed = 0
+
+    async def do(self, key, call, timeout=None):
+        self.calls += 1
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.collapsed += 1
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "collapsed": self.collapsed,
+            "in_flight": len(self.in_flight),
+        }
@@ -0,0 +1,131 @@
+"""
+Persistent cache for static soil data
+
+Soil queries use time_resolution="static", so the answer for a soil grid
+cell never changes. Entries are stored in SQLite keyed by the cell of the
+SOILGRIDS1000 grid (30 arc seconds, ~1 km) and survive restarts. Answers
+without any value, e.g. for a failed gap fill or a point at sea, are not
+stored, so the cell is fetched again by the next request.
+"""
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from model.llm_wrapper.services.grid import grid_cell
+
+SOIL_DOMAIN = "SOILGRIDS1000"
+DEFAULT_PATH = Path(__file__).parent.parent / "data" / "soil_cache.sqlite3"
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def soil_cell(latitude, longitude):
+    """
+    Returns the (row, column) index of the soil grid cell containing the point
+    """
+    _, row, column = grid_cell(latitude, longitude, SOIL_DOMAIN)
+    return row, column
+
+
+class SoilCache:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS soil (
+                row INTEGER NOT NULL,
+                col INTEGER NOT NULL,
+                soil_moisture REAL,
+                soil_ph REAL,
+                soil_nitrogen_content REAL,
+                PRIMARY KEY (row, col)
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.commit()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, latitude, longitude):
+        """
+        Returns the cached soil data of the point's cell or None
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT soil_moisture, soil_ph, soil_nitrogen_content "
+                "FROM soil WHERE row = ? AND col = ?",
+                soil_cell(latitude, longitude),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return {
+            "soil_moisture": row[0],
+            "soil_ph": row[1],
+            "soil_nitrogen_content": row[2],
+        }
+
+    def put(self, latitude, longitude, soil_data):
+        if all(value is None for value in soil_data.values()):
+            return
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO soil VALUES (?, ?, ?, ?, ?)",
+                (
+                    *soil_cell(latitude, longitude),
+                    soil_data["soil_moisture"],
+                    soil_data["soil_ph"],
+                    soil_data["soil_nitrogen_content"],
+                ),
+            )
+            self.connection.commit()
+
+    def get_or_fetch(self, latitude, longitude, fetch):
+        soil_data = self.get(latitude, longitude)
+        if soil_data is None:
+            soil_data = fetch(latitude, longitude)
+            self.put(latitude, longitude, soil_data)
+        return soil_data
+
+    def warm_up(self, coordinates, fetch):
+        """
+        Fetches every cell of [(latitude, longitude), ...] not cached yet
+        Returns the number of upstream fetches
+        """
+        with self.lock:
+            cached = set(self.connection.execute("SELECT row, col FROM soil"))
+
+        fetched = 0
+        for latitude, longitude in coordinates:
+            cell = soil_cell(latitude, longitude)
+            if cell in cached:
+                continue
+            self.put(latitude, longitude, fetch(latitude, longitude))
+            cached.add(cell)
+            fetched += 1
+        return fetched
+
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM soil").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def get_soil_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SoilCache(os.getenv("SOIL_CACHE_PATH", str(DEFAULT_PATH)))
+    return _cache
@@ -1,7 +1,46 @@
-import requests
-from model.llm_wrapper.services.meteoblue_model import MeteoblueQuery
+from model.llm_wrapper.services.meteoblue_dataset import get_query
+from model.llm_wrapper.services.meteoblue_decoder import to_float
+from model.llm_wrapper.services.query_planner import QueryPlanner
+from model.llm_wrapper.services.soil_cache import get_soil_cache
 from datetime import datetime, timedelta
-import os
+
+
+SOIL_MOISTURE = {
+    "domain": "SOILGRIDS1000",
+    "gap_fill_domain": "NEMSGLOBAL",
+    "time_resolution": "static",
+    "code_dict": {"code": 800, "level": "0 cm"},
+}
+
+SOIL_PH = {
+    "domain": "SOILGRIDS",
+    "gap_fill_domain": "NEMSGLOBAL",
+    "time_resolution": "static",
+    "code_dict": {
+        "code": 812,
+        "level": "aggregated",
+        "startDepth": 0,
+        "endDepth": 150,
+    },
+}
+
+SOIL_NITROGEN_CONTENT = {
+    "domain": "SOILGRIDS2",
+    "gap_fill_domain": "SOILGRIDS2_1000",
+    "time_resolution": "static",
+    "code_dict": {
+        "code": 817,
+        "level": "aggregated",
+        "startDepth": 0,
+        "endDepth": 150,
+    },
+}
+
+SOIL_SERIES = {
+    "soil_moisture": SOIL_MOISTURE,
+    "soil_ph": SOIL_PH,
+    "soil_nitrogen_content": SOIL_NITROGEN_CONTENT,
+}
 
 
 def fetch_soil_data(latitude, longitude):
@@ -13,56 +52,34 @@ def fetch_soil_data(latitude, longitude):
         "soil_nitrogen_content": float
     }
     """
-    query = MeteoblueQuery()
-    query.set_coordinates(latitude=latitude, longitude=longitude)
-    query.set_time_interval(
-        start=datetime.now() - timedelta(days=1), end=datetime.now()
-    )
-    query.add_query(
-        domain="SOILGRIDS1000",
-        gap_fill_domain="NEMSGLOBAL",
-        time_resolution="static",
-        code_dict={"code": 800, "level": "0 cm"},
-    )
-    query.add_query(
-        domain="SOILGRIDS",
-        gap_fill_domain="NEMSGLOBAL",
-        time_resolution="static",
-        code_dict={
-            "code": 812,
-            "level": "aggregated",
-            "startDepth": 0,
-            "endDepth": 150,
-        },
-    )
-    query.add_query(
-        domain="SOILGRIDS2",
-        gap_fill_domain="SOILGRIDS2_1000",
-        time_resolution="static",
-        code_dict={
-            "code": 817,
-            "level": "aggregated",
-            "startDepth": 0,
-            "endDepth": 150,
-        },
-    )
-    response = get_query(query)
-    parsed = {
-        "soil_moisture": response[0]["codes"][0]["dataPerTimeInterval"][0]["data"][0][
-            0
-        ],
-        "soil_ph": response[1]["codes"][0]["dataPerTimeInterval"][0]["data"][0][0],
-        "soil_nitrogen_content": response[2]["codes"][0]["dataPerTimeInterval"][0][
-            "data"
-        ][0][0],
+    return get_soil_cache().get_or_fetch(latitude, longitude, fetch_soil_data_upstream)
+
+
+def fetch_soil_data_upstream(latitude, longitude):
+    planner = QueryPlanner(latitude, longitude)
+    keys = plan_soil_data(planner)
+    return parse_soil_data(planner.execute(get_query), keys)
+
+
+def warm_up_soil_cache(coordinates):
+    """
+    Fills the soil cache for [(latitude, longitude), ...]
+    Returns the number of upstream fetches
+    """
+    return get_soil_cache().warm_up(coordinates, fetch_soil_data_upstream)
+
+
+def plan_soil_data(planner, now=None):
+    """
+    Registers the soil series on a QueryPlanner, returns {name: key}
+    """
+    now = now or datetime.now()
+    return {
+        name: planner.add(**series, start=now - timedelta(days=1), end=now)
+        for name, series in SOIL_SERIES.items()
     }
-    return parsed
 
 
-def get_query(query):
-    response = requests.post(
-        url=f"https://my.meteoblue.com/dataset/query?apikey={os.getenv('HISTORICAL_API_KEY')}",
-        json=query.body,
-        headers={"Content-Type": "application/json"},
-    )
-    return response.json()
+def parse_soil_data(series, keys):
+    return {name: to_float(series[key][0]) for name, key in keys.items()}
+
@@ -0,0 +1,117 @@
+"""
+Point to state lookup over the Brazilian state boundaries
+
+The GeoJSON is parsed once and the geometries are pickled next to the other
+local caches, keyed by the sha256 of the GeoJSON, so later loads skip the
+parsing. Lookups query an STRtree of the prepared state geometries with all
+points at once.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+from pathlib import Path
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+NAME_PROPERTY = "name"
+CODE_PROPERTY = "sigla"
+DEFAULT_PATH = Path(__file__).parent.parent.parent / "data" / "brazil-states.geojson"
+DEFAULT_CACHE_DIRECTORY = Path(__file__).parent.parent / "data" / "state_index"
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class StateIndex:
+    def __init__(self, names, codes, geometries):
+        self.names = np.array(names, dtype=object)
+        self.codes = np.array(codes, dtype=object)
+        self.geometries = np.array(geometries, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    def lookup(self, latitudes, longitudes):
+        """
+        Returns int array of state indices per point, -1 outside every state
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        points = shapely.points(
+            np.asarray(longitudes, dtype=np.float64).ravel(), latitudes.ravel()
+        )
+        point_indices, state_indices = self.tree.query(points, predicate="intersects")
+        # Points on a shared border take the state listed first
+        states = np.full(points.shape, len(self.geometries))
+        np.minimum.at(states, point_indices, state_indices)
+        states[states == len(self.geometries)] = -1
+        return states.reshape(latitudes.shape)
+
+    def state_codes(self, latitudes, longitudes):
+        """
+        Returns object array of state codes per point, None outside every state
+        """
+        states = self.lookup(latitudes, longitudes)
+        return np.where(states >= 0, self.codes[states], None)
+
+    def state_names(self, latitudes, longitudes):
+        states = self.lookup(latitudes, longitudes)
+        return np.where(states >= 0, self.names[states], None)
+
+    def get_state(self, latitude, longitude):
+        """
+        Returns (name, code) of the state containing the point or None
+        """
+        state = self.lookup([latitude], [longitude])[0]
+        if state < 0:
+            return None
+        return self.names[state], self.codes[state]
+
+
+def parse_states(geojson):
+    features = json.loads(geojson)["features"]
+    return (
+        [feature["properties"][NAME_PROPERTY] for feature in features],
+        [feature["properties"][CODE_PROPERTY] for feature in features],
+        [shape(feature["geometry"]) for feature in features],
+    )
+
+
+def load_state_index(geojson_path=DEFAULT_PATH, cache_directory=None):
+    """
+    Returns the StateIndex of a GeoJSON, from the pickle cache when present
+    """
+    geojson = Path(geojson_path).read_bytes()
+    digest = hashlib.sha256(geojson).hexdigest()
+    cache_directory = Path(cache_directory or DEFAULT_CACHE_DIRECTORY)
+    cache_path = cache_directory / f"{digest}.pickle"
+
+    if cache_path.exists():
+        try:
+            with open(cache_path, "rb") as cache:
+                return StateIndex(*pickle.load(cache))
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(f"Error loading state index cache {cache_path}: {e}")
+
+    states = parse_states(geojson)
+    cache_directory.mkdir(parents=True, exist_ok=True)
+    temporary = cache_path.with_suffix(".tmp")
+    with open(temporary, "wb") as cache:
+        pickle.dump(states, cache, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, cache_path)
+    return StateIndex(*states)
+
+
+def get_state_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_state_index(
+                    os.getenv("STATE_BOUNDARIES_PATH", str(DEFAULT_PATH)),
+                    os.getenv("STATE_INDEX_CACHE_DIR"),
+                )
+    return _index
@@ -1,4 +1,5 @@
 import requests
+import model.llm_wrapper.services.http_client as http_client
 import datetime
 from dotenv import load_dotenv
 import os
@@ -61,7 +62,7 @@ def get_short_range_forecast(latitude, longitude, days=3):
     }
     
     try:
-        response = requests.get(endpoint, params=params, headers=headers)
+        response = http_client.get(endpoint, params=params, headers=headers)
         response.raise_for_status()  # Raise exception for HTTP errors
         
         data = response.json()
@@ -1,16 +1,58 @@
-import pandas as pd
-import numpy as np
+"""
+Derived feature columns of the extracted field dataset
+
+The job runs in two steps:
+
+1. The input (CSV or Parquet) is streamed in chunks of CHUNK_ROWS rows and
+   split into one staging Parquet file per (Crop, state) partition, while a
+   content hash of every partition's rows is accumulated.
+2. Partitions whose hash differs from the manifest of the previous run are
+   computed in a process pool. Every partition is streamed again in
+   batches of CHUNK_ROWS rows, every derived column is a vectorized
+   expression and the result is written as
+   OUTPUT_DIR/Crop=<crop>/state=<state>/part-0.parquet with float32 columns.
+
+Memory stays bounded by the chunk size in both steps, whatever the size of
+the input or of a partition. The input must have the columns of
+REQUIRED_COLUMNS, a ValueError naming the missing ones is raised before
+anything is written.
 
-df = pd.read_csv("extracted_data.csv")
+pyarrow.dataset or pandas.read_parquet read OUTPUT_DIR back with Crop and
+state restored from the directory names.
+"""
 
-# Heat Stress day
-df["HeatStress"] = 9 * ((df["TMAX"] - 30) / (40 - 30))  # Crop-specific thresholds
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import quote
 
-# Drought Index
-df["DroughtIndex"] = (df["Precipitation"] - df["Evapotranspiration"] + df["SoilMoisture"]) / df["TAVG"]
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-# Frost stress 
-df["FrostStress"] = np.where(df["TMIN"] < 0, 1, 0)
+INPUT_PATH = "extracted_data.csv"
+OUTPUT_DIR = "final_dataset"
+CHUNK_ROWS = 200_000
+PARTITION_COLUMNS = ["Crop", "state"]
+REQUIRED_COLUMNS = PARTITION_COLUMNS + [
+    "TMAX",
+    "TMIN",
+    "TAVG",
+    "Precipitation",
+    "Evapotranspiration",
+    "SoilMoisture",
+    "GDD",
+    "pH",
+    "N_Actual",
+    "P_Actual",
+    "Projected_Yield",
+]
+MANIFEST_NAME = "_manifest.json"
+STAGING_NAME = "_staging"
 
 # Crop-specific optimal values
 crop_optimal_values = {
@@ -18,32 +60,240 @@ crop_optimal_values = {
     "Corn": {"GDD_opt": 2900, "P_opt": 650, "pH_opt": 6.4, "N_opt": 0.115},
     "Cotton": {"GDD_opt": 2400, "P_opt": 1000, "pH_opt": 6.3, "N_opt": 0.072},
 }
+OPTIMAL_VALUES = pd.DataFrame.from_dict(crop_optimal_values, orient="index").astype(
+    np.float64
+)
 
 # Define weighting factors for Yield Risk
 w1, w2, w3, w4 = 0.3, 0.3, 0.2, 0.2
 
-# Compute Yield Risk
-df["YieldRisk"] = df.apply(lambda row: (
-    w1 * (row["GDD"] - crop_optimal_values[row["Crop"]]["GDD_opt"])**2 +
-    w2 * (row["Precipitation"] - crop_optimal_values[row["Crop"]]["P_opt"])**2 +
-    w3 * (row["pH"] - crop_optimal_values[row["Crop"]]["pH_opt"])**2 +
-    w4 * (row["N_Actual"] - crop_optimal_values[row["Crop"]]["N_opt"])**2
-), axis=1)
+# Example optimal soil moisture = 60%
+OPTIMAL_SOIL_MOISTURE = 0.6
+
+
+def compute_features(df):
+    """
+    Returns the chunk with the crop optimal values joined as GDD_opt, P_opt,
+    pH_opt and N_opt columns and every derived column added, rows of
+    unknown crops get NaN in the crop-specific columns
+    """
+    df = df.join(OPTIMAL_VALUES, on="Crop")
+
+    # Heat Stress day
+    df["HeatStress"] = 9 * ((df["TMAX"] - 30) / (40 - 30))
+
+    # Drought Index
+    df["DroughtIndex"] = (
+        df["Precipitation"] - df["Evapotranspiration"] + df["SoilMoisture"]
+    ) / df["TAVG"]
+
+    # Frost stress
+    df["FrostStress"] = np.where(df["TMIN"] < 0, 1, 0).astype(np.int8)
+
+    # Yield Risk
+    df["YieldRisk"] = (
+        w1 * (df["GDD"] - df["GDD_opt"]) ** 2
+        + w2 * (df["Precipitation"] - df["P_opt"]) ** 2
+        + w3 * (df["pH"] - df["pH_opt"]) ** 2
+        + w4 * (df["N_Actual"] - df["N_opt"]) ** 2
+    )
+
+    # Rainfall Factor (RF) and Soil Moisture Factor (SMF)
+    df["RF"] = df["Precipitation"] / df["P_opt"]
+    df["SMF"] = df["SoilMoisture"] / OPTIMAL_SOIL_MOISTURE
+
+    # NUE
+    df["NUE"] = (df["Projected_Yield"] / df["N_Actual"]) * df["RF"] * df["SMF"]
+
+    # pH Factor (pHf) for PUE
+    df["pHf"] = df["pH"] / df["pH_opt"]
+
+    # Soil Factor (SF) for PUE
+    df["SF"] = (df["pHf"] + df["SMF"] + df["RF"]) / 3
+
+    # PUE
+    df["PUE"] = (df["Projected_Yield"] / df["P_Actual"]) * df["SF"]
+
+    return df
+
+
+def read_chunks(input_path, chunk_rows):
+    """
+    Yields DataFrames of at most chunk_rows rows from a CSV or Parquet file
+    """
+    if Path(input_path).suffix == ".parquet":
+        for batch in pq.ParquetFile(input_path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(input_path, chunksize=chunk_rows)
+
+
+def read_columns(input_path):
+    """
+    Returns the column names of a CSV or Parquet file without reading rows
+    """
+    if Path(input_path).suffix == ".parquet":
+        return pq.ParquetFile(input_path).schema_arrow.names
+    return list(pd.read_csv(input_path, nrows=0).columns)
+
+
+def validate_columns(input_path):
+    missing = [
+        column for column in REQUIRED_COLUMNS if column not in read_columns(input_path)
+    ]
+    if missing:
+        raise ValueError(
+            f"{input_path} is missing the required columns {', '.join(missing)}"
+        )
+
+
+def partition_path(crop, state):
+    return Path(
+        f"{PARTITION_COLUMNS[0]}={quote(str(crop), safe='')}",
+        f"{PARTITION_COLUMNS[1]}={quote(str(state), safe='')}",
+    )
+
+
+def split_partitions(input_path, staging_dir, chunk_rows):
+    """
+    Writes the rows of every (Crop, state) to staging_dir/<partition>.parquet
+
+    Returns {partition path: sha256 of the partition rows}
+    """
+    writers = {}
+    hashes = {}
+    try:
+        for chunk in read_chunks(input_path, chunk_rows):
+            # Numbers are written as float64 so chunks agree on one schema
+            numeric = chunk.select_dtypes("number").columns
+            chunk = chunk.astype({column: np.float64 for column in numeric})
+            groups = chunk.groupby(PARTITION_COLUMNS, sort=False, dropna=False)
+            for (crop, state), rows in groups:
+                partition = str(partition_path(crop, state))
+                table = pa.Table.from_pandas(rows, preserve_index=False)
+                if partition not in writers:
+                    path = staging_dir / f"{partition}.parquet"
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    writers[partition] = pq.ParquetWriter(path, table.schema)
+                    hashes[partition] = hashlib.sha256(",".join(rows.columns).encode())
+                writers[partition].write_table(table.cast(writers[partition].schema))
+                hashes[partition].update(
+                    pd.util.hash_pandas_object(rows, index=False).values.tobytes()
+                )
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return {partition: digest.hexdigest() for partition, digest in hashes.items()}
+
+
+def compute_partition(staging_path, output_path, chunk_rows=CHUNK_ROWS):
+    """
+    Computes one partition in batches of chunk_rows rows, runs in a worker
+    process
+
+    Returns the number of rows written
+    """
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = output_path.with_suffix(".tmp")
+    writer = None
+    rows = 0
+    try:
+        for batch in pq.ParquetFile(staging_path).iter_batches(batch_size=chunk_rows):
+            df = compute_features(batch.to_pandas())
+            # Crop and state are encoded in the partition directories
+            df = df.drop(columns=PARTITION_COLUMNS)
+            floats = df.select_dtypes(np.float64).columns
+            df = df.astype({column: np.float32 for column in floats})
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(temporary, table.schema)
+            writer.write_table(table.cast(writer.schema))
+            rows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError(f"{staging_path} has no rows")
+    os.replace(temporary, output_path)
+    return rows
+
+
+def read_manifest(output_dir):
+    path = output_dir / MANIFEST_NAME
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def write_manifest(output_dir, manifest):
+    path = output_dir / MANIFEST_NAME
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(temporary, path)
+
+
+def compute_dataset(
+    input_path=INPUT_PATH, output_dir=OUTPUT_DIR, chunk_rows=None, workers=None
+):
+    """
+    Computes the partitioned dataset of input_path into output_dir, skipping
+    partitions whose input rows did not change since the previous run
+
+    Returns (computed partitions, skipped partitions, rows written)
+    """
+    validate_columns(input_path)
+    chunk_rows = chunk_rows or CHUNK_ROWS
+    output_dir = Path(output_dir)
+    staging_dir = output_dir / STAGING_NAME
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    previous = read_manifest(output_dir)
+    hashes = split_partitions(input_path, staging_dir, chunk_rows)
 
-# Rainfall Factor (RF) and Soil Moisture Factor (SMF)
-df["RF"] = df["Precipitation"] / df["P_opt"]
-df["SMF"] = df["SoilMoisture"] / 0.6  # Example optimal soil moisture = 60%
+    changed = [
+        partition
+        for partition, digest in hashes.items()
+        if previous.get(partition) != digest
+        or not (output_dir / partition / "part-0.parquet").exists()
+    ]
+    manifest = {
+        partition: digest
+        for partition, digest in previous.items()
+        if partition in hashes and partition not in changed
+    }
 
-# Compute NUE
-df["NUE"] = (df["Projected_Yield"] / df["N_Actual"]) * df["RF"] * df["SMF"]
+    rows = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = {
+                pool.submit(
+                    compute_partition,
+                    staging_dir / f"{partition}.parquet",
+                    output_dir / partition / "part-0.parquet",
+                    chunk_rows,
+                ): partition
+                for partition in changed
+            }
+            for future, partition in futures.items():
+                try:
+                    rows += future.result()
+                except Exception as e:
+                    print(f"Error computing partition {partition}: {e}")
+                    continue
+                manifest[partition] = hashes[partition]
+    finally:
+        write_manifest(output_dir, manifest)
+        shutil.rmtree(staging_dir, ignore_errors=True)
 
-# Compute pH Factor (pHf) for PUE
-df["pHf"] = df["pH"] / crop_optimal_values[df["Crop"]]["pH_opt"]
+    # Partitions no longer present in the input
+    for partition in previous.keys() - hashes.keys():
+        shutil.rmtree(output_dir / partition, ignore_errors=True)
 
-# Compute Soil Factor (SF) for PUE
-df["SF"] = (df["pHf"] + df["SMF"] + df["RF"]) / 3
+    return len(changed), len(hashes) - len(changed), rows
 
-# Compute PUE
-df["PUE"] = (df["Projected_Yield"] / df["P_Actual"]) * df["SF"]
 
-df.to_csv("final_dataset.csv", index=False)
+if __name__ == "__main__":
+    computed, skipped, rows = compute_dataset()
+    print(
+        f"Computed {computed} partitions ({rows} rows), "
+        f"skipped {skipped} unchanged partitions in {OUTPUT_DIR}"
+    )
@@ -1,11 +1,15 @@
 import geopandas as gpd
 import pandas as pd
 import numpy as np
-import random
-from shapely.geometry import Point
+import math
+import shapely
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
+from model.llm_wrapper.services.state_index import load_state_index
+
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 
 # Define relative paths
@@ -15,60 +19,170 @@ OUTPUT_PATH = DATA_DIR / "processed" / "state_random_points.csv"
 
 (DATA_DIR / "processed").mkdir(parents=True, exist_ok=True)
 
-def extract_random_points_per_state(geojson_path, points_per_state=20):
+SAMPLING_METHODS = ('uniform', 'stratified', 'poisson')
+
+# Largest number of candidate points drawn at once
+MAX_BATCH = 1_000_000
+
+# Poisson-disc radius relative to sqrt(area / points), random sequential
+# packing saturates around 0.83 so the quota stays reachable
+POISSON_SPACING = 0.7
+
+def sample_uniform(geometry, count, rng):
+    """
+    Draws points uniformly inside a prepared geometry
+
+    Candidates are drawn in vectorized batches over the bounding box, sized
+    by the expected acceptance rate, until count points are inside.
+
+    Returns:
+        (count, 2) array of longitude, latitude
+    """
+    minx, miny, maxx, maxy = geometry.bounds
+    acceptance = geometry.area / ((maxx - minx) * (maxy - miny))
+
+    batches = []
+    found = 0
+    while found < count:
+        size = min(int((count - found) / acceptance * 1.2) + 16, MAX_BATCH)
+        x = rng.uniform(minx, maxx, size)
+        y = rng.uniform(miny, maxy, size)
+        inside = shapely.contains_xy(geometry, x, y)
+        batches.append(np.column_stack([x[inside], y[inside]]))
+        found += int(inside.sum())
+
+    return np.concatenate(batches)[:count]
+
+def sample_stratified(geometry, count, rng):
+    """
+    Draws one jittered point per cell of a regular grid inside the geometry
+
+    The cell size starts at sqrt(area / count) and shrinks until enough
+    cells fall inside, then count of the inside points are kept.
+
+    Returns:
+        (count, 2) array of longitude, latitude
+    """
+    minx, miny, maxx, maxy = geometry.bounds
+    cell = math.sqrt(geometry.area / count)
+
+    while True:
+        x, y = np.meshgrid(np.arange(minx, maxx, cell), np.arange(miny, maxy, cell))
+        x = x.ravel() + rng.uniform(0, cell, x.size)
+        y = y.ravel() + rng.uniform(0, cell, y.size)
+        inside = np.flatnonzero(shapely.contains_xy(geometry, x, y))
+        if len(inside) >= count:
+            chosen = np.sort(rng.choice(inside, count, replace=False))
+            return np.column_stack([x[chosen], y[chosen]])
+        cell *= 0.9
+
+def sample_poisson_disc(geometry, count, rng, min_distance=None):
+    """
+    Draws points inside the geometry at least min_distance degrees apart
+
+    Uniform candidates are accepted greedily against a background grid of
+    cells of min_distance / sqrt(2), which hold at most one point each. When
+    a batch of candidates barely adds points the distance is reduced by 10%
+    so the quota is always reached.
+
+    Returns:
+        (count, 2) array of longitude, latitude
+    """
+    if min_distance is None:
+        min_distance = POISSON_SPACING * math.sqrt(geometry.area / count)
+    minx, miny = geometry.bounds[:2]
+
+    def build_grid(points, distance):
+        cell = distance / math.sqrt(2)
+        return cell, {
+            (int((x - minx) // cell), int((y - miny) // cell)): (x, y)
+            for x, y in points
+        }
+
+    accepted = []
+    cell, grid = build_grid(accepted, min_distance)
+    while len(accepted) < count:
+        candidates = sample_uniform(geometry, 2 * (count - len(accepted)) + 64, rng)
+        added = 0
+        for x, y in candidates.tolist():
+            column, row = int((x - minx) // cell), int((y - miny) // cell)
+            if any(
+                (x - other[0]) ** 2 + (y - other[1]) ** 2 < min_distance**2
+                for i in range(column - 2, column + 3)
+                for j in range(row - 2, row + 3)
+                if (other := grid.get((i, j))) is not None
+            ):
+                continue
+            grid[(column, row)] = (x, y)
+            accepted.append((x, y))
+            added += 1
+            if len(accepted) == count:
+                break
+        if added < len(candidates) / 100:
+            min_distance *= 0.9
+            cell, grid = build_grid(accepted, min_distance)
+
+    return np.array(accepted)
+
+def sample_state(geometry, count, seed, method='uniform', min_distance=None):
+    """Samples one state, runs in a worker process"""
+    if geometry.is_empty or geometry.area == 0:
+        raise ValueError('Cannot sample points inside an empty geometry')
+    shapely.prepare(geometry)
+    rng = np.random.default_rng(seed)
+
+    if method == 'uniform':
+        return sample_uniform(geometry, count, rng)
+    if method == 'stratified':
+        return sample_stratified(geometry, count, rng)
+    if method == 'poisson':
+        return sample_poisson_disc(geometry, count, rng, min_distance)
+    raise ValueError(f'Unknown sampling method {method}, expected one of {SAMPLING_METHODS}')
+
+def extract_random_points_per_state(geojson_path, points_per_state=20, seed=None,
+                                    method='uniform', min_distance=None, workers=None):
     """
     Extract random points from each state's boundary
     
     Args:
         geojson_path: Path to GeoJSON with state boundaries
         points_per_state: Number of random points to extract per state
+        seed: Seed of the random generator, the same seed gives the same points
+        method: 'uniform', 'stratified' (one jittered point per grid cell) or
+            'poisson' (Poisson-disc, points at least min_distance apart)
+        min_distance: Poisson-disc spacing in degrees, derived from the
+            state area when omitted
+        workers: Number of processes, states are sampled in parallel
         
     Returns:
         DataFrame with sampled points and their state info
     """
-    states = gpd.read_file(geojson_path)
-    
-    all_points = []
-    
-    for idx, state in states.iterrows():
-        state_name = state['name']
-        state_code = state['sigla']
-        state_geometry = state['geometry']
-        
-        minx, miny, maxx, maxy = state_geometry.bounds
-        
-        # Generate random points inside the state boundary
-        state_points = []
-        attempts = 0
-        
-        # Keep trying until we get enough points or too many attempts
-        while len(state_points) < points_per_state and attempts < 1000:
-            # Generate a random point within the bounding box
-            x = random.uniform(minx, maxx)
-            y = random.uniform(miny, maxy)
-            point = Point(x, y)
-            
-            # Check if the point is inside the state boundary
-            if state_geometry.contains(point):
-                state_points.append({
-                    'state': state_name,
-                    'state_code': state_code,
-                    'longitude': x,
-                    'latitude': y
-                })
-            
-            attempts += 1
-        
-        all_points.extend(state_points)
-    
-    # Convert to DataFrame
-    points_df = pd.DataFrame(all_points)
+    states = load_state_index(geojson_path)
+
+    # Independent per-state streams keep results reproducible whatever the
+    # order in which the processes finish
+    seeds = np.random.SeedSequence(seed).spawn(len(states.geometries))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        samples = list(pool.map(
+            partial(sample_state, method=method, min_distance=min_distance),
+            states.geometries,
+            [points_per_state] * len(seeds),
+            seeds,
+        ))
+
+    points_df = pd.DataFrame({
+        'state': np.repeat(states.names, points_per_state),
+        'state_code': np.repeat(states.codes, points_per_state),
+        'longitude': np.concatenate([points[:, 0] for points in samples]),
+        'latitude': np.concatenate([points[:, 1] for points in samples]),
+    })
     
     return points_df
 
 def visualize_points(geojson_path, points_df):
     """Visualize the sampled points on a map of Brazil"""
-    states = gpd.read_file(geojson_path)
+    states = gpd.GeoSeries(load_state_index(geojson_path).geometries)
     
     fig, ax = plt.subplots(figsize=(12, 20))
     states.plot(ax=ax, color='lightgrey', edgecolor='black')
@@ -93,7 +207,7 @@ def visualize_points(geojson_path, points_df):
 # Example usage
 if __name__ == "__main__":
     # Use the defined paths
-    points_df = extract_random_points_per_state(GEOJSON_PATH, points_per_state=20)
+    points_df = extract_random_points_per_state(GEOJSON_PATH, points_per_state=20, seed=42)
     
     # Save points to CSV using relative path
     points_df.to_csv(OUTPUT_PATH, index=False)
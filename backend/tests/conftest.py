@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The backend imports its modules as model.llm_wrapper...
+sys.path.insert(0, str(Path(__file__).parent.parent))
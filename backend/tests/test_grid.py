@@ -0,0 +1,45 @@
+import pytest
+
+from model.llm_wrapper.services.grid import (
+    DOMAIN_RESOLUTIONS,
+    grid_cell,
+    shared_point,
+    snap,
+)
+
+
+@pytest.mark.parametrize("domain", sorted(DOMAIN_RESOLUTIONS))
+def test_points_snap_to_the_nearest_grid_point(domain):
+    step = DOMAIN_RESOLUTIONS[domain]
+    for latitude, longitude in ((-15.5432, -47.8765), (-3.1, -60.02), (0.0, 0.0)):
+        snapped = snap(latitude, longitude, domain)
+        for coordinate, value in zip(snapped, (latitude, longitude)):
+            index = coordinate / step
+            assert index == pytest.approx(round(index), abs=1e-4)
+            assert abs(coordinate - value) <= step / 2 + 1e-9
+
+
+def test_nemsglobal_grid_points():
+    assert snap(-15.5432, -47.8, "NEMSGLOBAL") == (-15.5, -47.75)
+    # Points of one native cell share the grid point
+    assert grid_cell(-15.4, -47.7, "NEMSGLOBAL") == grid_cell(
+        -15.6, -47.8, "NEMSGLOBAL"
+    )
+
+
+def test_points_between_grid_points_snap_consistently():
+    assert snap(-15.625, -47.625, "NEMSGLOBAL") == (-15.5, -47.5)
+    assert snap(15.625, 47.625, "NEMSGLOBAL") == (15.75, 47.75)
+
+
+def test_shared_point_resolves_to_the_grid_points_of_the_point():
+    domains = ("NEMSGLOBAL", "SOILGRIDS1000")
+    # The nearest soil point lies between two NEMSGLOBAL grid points
+    latitude, longitude = -15.1917, -46.376
+    assert snap(latitude, longitude, "SOILGRIDS1000")[1] == -46.375
+
+    point = shared_point(latitude, longitude, domains)
+    assert grid_cell(*point, "NEMSGLOBAL") == grid_cell(
+        latitude, longitude, "NEMSGLOBAL"
+    )
+    assert point == shared_point(*point, domains)
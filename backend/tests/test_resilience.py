@@ -0,0 +1,115 @@
+import asyncio
+
+import httpx
+import pytest
+
+from model.llm_wrapper.services import resilience
+from model.llm_wrapper.services.resilience import (
+    AdaptiveLimit,
+    CircuitBreaker,
+    Upstream,
+    UpstreamUnavailable,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failures=3, cooldown=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record(failed=True)
+    # A success resets the count
+    assert breaker.allow()
+    breaker.record(failed=False)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record(failed=True)
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_lets_one_trial_through_after_the_cooldown(clock):
+    breaker = CircuitBreaker(failures=1, cooldown=30)
+    breaker.allow()
+    breaker.record(failed=True)
+
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record(failed=False)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_opens_the_breaker_again(clock):
+    breaker = CircuitBreaker(failures=5, cooldown=30)
+    breaker.state, breaker.opened_at = CircuitBreaker.OPEN, clock[0] - 30
+    assert breaker.allow()
+
+    breaker.record(failed=True)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened_at == clock[0]
+    assert not breaker.allow()
+
+
+def test_cancelled_trial_can_be_retried(clock):
+    breaker = CircuitBreaker(failures=1, cooldown=0)
+    breaker.allow()
+    breaker.record(failed=True)
+    assert breaker.allow()
+
+    breaker.cancel()
+    assert breaker.allow()
+
+
+def test_rejected_async_call_keeps_the_trial_of_another_call():
+    upstream = Upstream("example.com")
+    upstream.breaker.state = CircuitBreaker.HALF_OPEN
+    upstream.breaker.trial_in_flight = True
+
+    async def send(timeout):
+        return httpx.Response(200)
+
+    with pytest.raises(UpstreamUnavailable, match="circuit open"):
+        asyncio.run(upstream.call_async(send, idempotent=False))
+    assert upstream.breaker.trial_in_flight
+
+
+def test_sync_call_refunds_the_token_without_a_slot():
+    upstream = Upstream("example.com")
+    upstream.timeout = (0.01, 0.01)
+    upstream.limit.limit = 1
+    upstream.limit.in_flight = 1
+    tokens = upstream.bucket.tokens
+
+    with pytest.raises(UpstreamUnavailable, match="no concurrency slot"):
+        upstream.call(lambda timeout: None, idempotent=False)
+    assert upstream.bucket.tokens == pytest.approx(tokens, abs=0.01)
+
+
+def test_async_acquire_waits_for_a_released_slot():
+    limit = AdaptiveLimit(initial=1, maximum=1)
+
+    async def scenario():
+        assert await limit.acquire_async(1)
+        waiting = asyncio.ensure_future(limit.acquire_async(1))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        limit.release()
+        assert await waiting
+        assert not await limit.acquire_async(0.01)
+
+    asyncio.run(scenario())
+    assert limit.in_flight == 1
+    assert limit.async_waiters == []
@@ -0,0 +1,113 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from model.llm_wrapper.services.series_archive import SeriesArchive
+
+LATITUDE, LONGITUDE = -15.5, -47.5
+NEMS = {
+    "domain": "NEMSGLOBAL",
+    "gap_fill_domain": None,
+    "time_resolution": "daily",
+    "code_dict": {"code": 11, "level": "2 m above gnd", "aggregation": "mean"},
+}
+ERA5T = dict(NEMS, domain="ERA5T")
+
+
+@pytest.fixture
+def archive(tmp_path):
+    # No TTL, days that are not final are always planned again
+    return SeriesArchive(tmp_path, ttl=timedelta(0))
+
+
+def days_ago(days):
+    return date.today() - timedelta(days=days)
+
+
+def test_final_days_are_not_planned(archive):
+    start = days_ago(30)
+    archive.store(LATITUDE, LONGITUDE, NEMS, start, np.arange(20, dtype=np.float32))
+
+    assert archive.plan(LATITUDE, LONGITUDE, NEMS, start, days_ago(11)) is None
+    assert archive.plan(LATITUDE, LONGITUDE, NEMS, start, days_ago(5)) == (
+        days_ago(10),
+        days_ago(5),
+    )
+
+
+def test_recent_days_are_planned_after_the_ttl(tmp_path):
+    start = days_ago(5)
+    data = np.ones(6, dtype=np.float32)
+    for ttl, expected in ((timedelta(hours=1), None), (timedelta(0), days_ago(1))):
+        archive = SeriesArchive(tmp_path, ttl=ttl)
+        archive.store(LATITUDE, LONGITUDE, NEMS, start, data)
+        planned = archive.plan(LATITUDE, LONGITUDE, NEMS, start, date.today())
+        assert (planned and planned[0]) == expected
+
+
+def test_gaps_are_never_final(archive):
+    start = days_ago(30)
+    data = np.ones(10, dtype=np.float32)
+    data[4] = np.nan
+    archive.store(LATITUDE, LONGITUDE, NEMS, start, data)
+
+    assert archive.plan(LATITUDE, LONGITUDE, NEMS, start, days_ago(21)) == (
+        days_ago(26),
+        days_ago(21),
+    )
+
+
+def test_final_lag_depends_on_the_domain(archive):
+    start = days_ago(10)
+    data = np.ones(11, dtype=np.float32)
+    archive.store(LATITUDE, LONGITUDE, NEMS, start, data)
+    archive.store(LATITUDE, LONGITUDE, ERA5T, start, data)
+
+    assert archive.plan(LATITUDE, LONGITUDE, NEMS, start, days_ago(2)) is None
+    assert archive.plan(LATITUDE, LONGITUDE, ERA5T, start, days_ago(2)) == (
+        days_ago(5),
+        days_ago(2),
+    )
+
+
+def test_window_stats_match_the_values(archive):
+    rng = np.random.default_rng(0)
+    start = date(2024, 1, 1)
+    expected = np.full(400, np.nan)
+    # Overlapping writes, a gap between writes and gaps within them
+    for offset, length in ((0, 100), (150, 100), (50, 150), (300, 100), (10, 5)):
+        data = rng.normal(10, 5, length).astype(np.float32)
+        data[rng.random(length) < 0.1] = np.nan
+        archive.store(LATITUDE, LONGITUDE, NEMS, start + timedelta(days=offset), data)
+        expected[offset : offset + length] = data
+
+    for first, last in ((0, 0), (0, 399), (45, 160), (240, 310), (390, 420)):
+        window = expected[first : last + 1]
+        present = window[~np.isnan(window)]
+        total, count, missing = archive.window_stats(
+            LATITUDE,
+            LONGITUDE,
+            NEMS,
+            start + timedelta(days=first),
+            start + timedelta(days=last),
+        )
+        assert total == pytest.approx(present.sum(), rel=1e-6)
+        assert count == len(present)
+        assert missing == last - first + 1 - len(present)
+
+    read = archive.read(
+        LATITUDE,
+        LONGITUDE,
+        NEMS,
+        start + timedelta(days=390),
+        start + timedelta(days=409),
+    )
+    np.testing.assert_array_equal(read[:10], expected[390:400].astype(np.float32))
+    assert np.isnan(read[10:]).all()
+
+
+def test_window_mean_of_an_empty_window_is_nan(archive):
+    assert np.isnan(
+        archive.window_mean(LATITUDE, LONGITUDE, NEMS, days_ago(10), days_ago(1))
+    )
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from model.llm_wrapper.services.single_flight import AsyncSingleFlight, SingleFlight
+
+
+def test_caller_timeout_does_not_fail_the_other_callers():
+    flights = SingleFlight()
+    release = threading.Event()
+    results = []
+
+    def call():
+        release.wait(1)
+        return "value"
+
+    follower = threading.Thread(target=lambda: results.append(flights.do("key", call)))
+    with pytest.raises(TimeoutError):
+        flights.do("key", call, timeout=0.01)
+    follower.start()
+    time.sleep(0.01)
+    release.set()
+    follower.join(1)
+
+    assert results == ["value"]
+    assert flights.stats() == {"calls": 2, "collapsed": 1, "in_flight": 0}
+
+
+def test_call_without_timeout_runs_in_the_caller_thread():
+    flights = SingleFlight()
+    assert flights.do("key", threading.get_ident) == threading.get_ident()
+
+
+def test_calls_with_timeout_share_the_pool_threads():
+    flights = SingleFlight(max_workers=1)
+    threads = {flights.do(key, threading.get_ident, timeout=1) for key in range(3)}
+    assert len(threads) == 1
+    assert threading.get_ident() not in threads
+
+
+def test_async_caller_timeout_does_not_cancel_the_call():
+    flights = AsyncSingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def scenario():
+        leader = asyncio.ensure_future(flights.do("key", call, timeout=0.01))
+        follower = asyncio.ensure_future(flights.do("key", call))
+        with pytest.raises(TimeoutError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == "value"
+    assert flights.stats() == {"calls": 2, "collapsed": 1, "in_flight": 0}